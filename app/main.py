@@ -1,74 +1,26 @@
+"""Streamlit front end for TrialGPT.
+
+Parse, retrieval and judge pull in openai, qdrant_client and fastembed, so
+they are imported inside the functions that need them. The location filter
+selectors are the exception: the first render loads the facets from Qdrant,
+which imports ``clinical_rag.retrieval`` (and with it those heavy packages)
+before any search is submitted. The result is cached for the process, so the
+cost is paid once per server rather than once per page load.
+"""
+
+import asyncio
+from collections.abc import Hashable
+from functools import lru_cache
+from itertools import chain
 import json
-from typing import Any, Iterable, List, Tuple
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
 
 import streamlit as st
 
 from clinical_rag.config import load_settings
-from clinical_rag.query_parser import parse
-from clinical_rag.retrieval import retrieve_with_exclusions, get_location_facets
-from clinical_rag.judge import judge_grouped
-
-
-@st.cache_data(show_spinner=False)
-def _load_location_facets() -> dict:
-    try:
-        return get_location_facets()
-    except Exception as exc:  # pragma: no cover - defensive UI fallback
-        st.warning(f"Unable to load location filters: {exc}")
-        return {"countries": [], "states_by_country": {}, "cities_by_region": {}}
-
-
-def _label_for(value: Any) -> str:
-    if value is None:
-        return "Not specified"
-    if isinstance(value, str):
-        value = value.strip()
-        return value.title() if value else "Not specified"
-    return str(value)
-
-
-def _make_options(values: Iterable[Any]) -> List[Tuple[str, Any]]:
-    opts: List[Tuple[str, Any]] = [("Not specified", None)]
-    for val in values:
-        if val is None:
-            continue
-        opts.append((_label_for(val), val))
-    return opts
-
-
-def _selectbox_with_reset(
-    label: str,
-    options: List[Tuple[str, Any]],
-    *,
-    key: str,
-    disabled: bool = False,
-) -> Any:
-    if not options:
-        options = [("Not specified", None)]
-    if key not in st.session_state or st.session_state[key] not in options:
-        st.session_state[key] = options[0]
-    selected: Tuple[str, Any] = st.selectbox(  # type: ignore[assignment]
-        label,
-        options,
-        key=key,
-        format_func=lambda opt: opt[0] if opt else "Not specified",
-        disabled=disabled,
-    )
-    return selected[1] if selected else None
-
 
-def main() -> None:
-    # ---------- Page config ----------
-    st.set_page_config(
-        page_title="TrialGPT",
-        page_icon="🏥",
-        layout="centered",
-        initial_sidebar_state="collapsed",
-    )
 
-    # ---------- Styles ----------
-    st.markdown(
-        """
+_STYLE_CSS = """
 <style>
   /* --- Layout width --- */
   .block-container { max-width: 760px; margin: 0 auto; }
@@ -127,9 +79,276 @@ def main() -> None:
   .spinner { width: 84px; height: 84px; border-radius: 50%; border: 10px solid #e9ecef; border-top-color: #667eea; animation: spin 1s linear infinite; }
   @keyframes spin { to { transform: rotate(360deg); } }
 </style>
-""",
-        unsafe_allow_html=True,
+"""
+
+# session_state key holding the last search's results across widget reruns
+_RESULTS_KEY = "_last_results"
+
+_LOADER_HTML = "<div class='loading-box'><div class='spinner'></div></div>"
+
+_TIPS_HTML = """
+<div class="search-tips">
+  <strong>💡 Tips:</strong> Any text format is acceptable (full sentences, bullets, etc.).
+</div>
+"""
+
+_FOOTER_HTML = """
+<div style="text-align: center; color: #6c757d; padding: 1rem 0 2rem;">
+  <p>This tool is for informational purposes only. Always consult a healthcare professional.</p>
+  <p><small>Data sourced from ClinicalTrials.gov (Snapshot: September 19, 2025)</small></p>
+</div>
+"""
+
+
+@st.cache_resource(show_spinner=False)
+def _load_location_facets() -> dict:
+    """Shared, read-only location facets; callers must not mutate the result."""
+    try:
+        from clinical_rag.retrieval import get_location_facets
+
+        return get_location_facets()
+    except Exception as exc:  # pragma: no cover - defensive UI fallback
+        st.warning(f"Unable to load location filters: {exc}")
+        return {"countries": [], "states_by_country": {}, "cities_by_region": {}}
+
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=512)
+def _parse_cached(query: str) -> dict:
+    """Parse a normalized query once per hour; hits return a fresh copy."""
+    from clinical_rag.query_parser import parse
+
+    return parse(query)
+
+
+# Canonical, compact spec encoding used as the retrieval cache key
+_SPEC_KEY_ENCODER = json.JSONEncoder(
+    ensure_ascii=False, sort_keys=True, separators=(",", ":")
+)
+
+
+@st.cache_resource(show_spinner=False, ttl=600, max_entries=128)
+def _retrieve_cached(spec_json: str, max_trials: int) -> dict:
+    """Retrieve trials for a canonical spec JSON string.
+
+    Uses cache_resource so the grouped hits are shared as-is instead of being
+    pickled on every hit; callers must treat the result as read-only.
+    """
+    from clinical_rag.retrieval import retrieve_with_exclusions
+
+    return retrieve_with_exclusions(json.loads(spec_json), max_trials=max_trials)
+
+
+def _locations_text(rep: Optional[dict]) -> str:
+    """Semicolon-separated "city, state, country" list for a trial's sites."""
+    locs = (rep or {}).get("locations") or []
+    if not isinstance(locs, list):
+        return "No locations listed."
+    items = []
+    for l in locs:
+        if not isinstance(l, dict):
+            continue
+        city = (l.get("city") or "").strip()
+        state = (l.get("state") or "").strip()
+        country = (l.get("country") or "").strip()
+        parts = [p for p in [city, state, country] if p]
+        if parts:
+            items.append(", ".join(parts))
+    return "; ".join(items) or "No locations listed."
+
+
+def _meta_html(status: str, phase: str, study_type: str) -> str:
+    badges = " ".join(
+        f"<span class='badge'>{v}</span>" for v in (status, phase, study_type) if v
     )
+    return f"<div class='meta'>{badges}</div>" if badges else ""
+
+
+def _label_for(value: Union[str, int, None]) -> str:
+    # Unhashable values can't be cache keys; format them directly
+    if not isinstance(value, Hashable):
+        return _format_label(value)
+    return _format_label_cached(value)
+
+
+def _format_label(value: Any) -> str:
+    if value is None:
+        return "Not specified"
+    if isinstance(value, str):
+        value = value.strip()
+        return value.title() if value else "Not specified"
+    return str(value)
+
+
+_format_label_cached = lru_cache(maxsize=4096)(_format_label)
+
+
+def _make_options(values: Iterable[Any]) -> List[Tuple[str, Any]]:
+    opts: List[Tuple[str, Any]] = [("Not specified", None)]
+    for val in values:
+        if val is None:
+            continue
+        opts.append((_label_for(val), val))
+    return opts
+
+
+@st.cache_data(show_spinner=False, max_entries=2048)
+def _make_options_cached(values: Tuple[Any, ...]) -> Tuple[Tuple[str, Any], ...]:
+    """Memoized `_make_options` for location facets, keyed by the value tuple."""
+    return tuple(_make_options(values))
+
+
+# Static dropdown options, built once per process instead of on every rerun
+_AGE_OPTIONS: List[Tuple[str, Any]] = [("Not specified", None)] + [
+    (str(age), age) for age in range(0, 121)
+]
+_SEX_OPTIONS: List[Tuple[str, Any]] = [
+    ("Not specified", None),
+    ("Female", "FEMALE"),
+    ("Male", "MALE"),
+]
+
+
+def _selectbox_with_reset(
+    label: str,
+    options: Sequence[Tuple[str, Any]],
+    *,
+    key: str,
+    disabled: bool = False,
+) -> Any:
+    if not options:
+        options = [("Not specified", None)]
+    if key not in st.session_state or st.session_state[key] not in options:
+        st.session_state[key] = options[0]
+    selected: Tuple[str, Any] = st.selectbox(  # type: ignore[assignment]
+        label,
+        options,
+        key=key,
+        format_func=lambda opt: opt[0] if opt else "Not specified",
+        disabled=disabled,
+    )
+    return selected[1] if selected else None
+
+
+def _normalize_results(judged: List[dict], grouped: dict) -> List[dict]:
+    """Join judge verdicts with their trial payloads for rendering."""
+    normalized = []
+    for j in judged:
+        nct = j.get("nct_id")
+        ctx = grouped.get(nct, {}) if isinstance(grouped, dict) else {}
+
+        # representative payload (prefer first inclusion, else first exclusion)
+        rep = None
+        for h in chain(ctx.get("incl", ()), ctx.get("excl", ())):
+            rep = h.payload or {}
+            if rep:
+                break
+
+        title = (rep or {}).get("trial_title") or nct or "Untitled Trial"
+        url = (rep or {}).get("url")
+        elig = (j.get("eligibility") or "").upper()
+        status = (rep or {}).get("overall_status") or ""
+        phase = (rep or {}).get("phase") or ""
+        study_type = (rep or {}).get("study_type") or ""
+
+        normalized.append(
+            {
+                "nct": nct,
+                "title": title,
+                "elig": elig,
+                "status": status,
+                "phase": phase,
+                "study_type": study_type,
+                "url": url,
+                "rep": rep,
+                # Rendered once per submit rather than on every rerun
+                "locations_joined": _locations_text(rep),
+                "meta_html": _meta_html(status, phase, study_type),
+                "ctx": ctx,
+                "judge": j,
+            }
+        )
+    return normalized
+
+
+def _render_card(item: dict) -> None:
+    j = item["judge"]
+    ctx = item["ctx"]
+
+    with st.container(border=True):
+        st.markdown(
+            f"**{item['title']}** "
+            f"<span class='elig-{item['elig'].replace(' ', '_')}'>{item['elig']}</span>",
+            unsafe_allow_html=True,
+        )
+
+        if item["meta_html"]:
+            st.markdown(item["meta_html"], unsafe_allow_html=True)
+
+        if item["url"]:
+            st.caption(item["url"])
+
+        # Locations (expander, semicolon-separated list of all sites)
+        with st.expander("Locations", expanded=False):
+            st.write(item["locations_joined"])
+
+        explanation = j.get("explanation") or ""
+        if explanation:
+            st.write("Explanation:")
+            st.write(explanation)
+
+        # Full criteria expander
+        with st.expander("All eligibility criteria", expanded=False):
+            col_in, col_ex = st.columns(2)
+            with col_in:
+                st.caption("Inclusion")
+                for h in ctx.get("incl", []):
+                    p = h.payload or {}
+                    if p.get("text"):
+                        st.write(f"- {p.get('text')}")
+            with col_ex:
+                st.caption("Exclusion")
+                for h in ctx.get("excl", []):
+                    p = h.payload or {}
+                    if p.get("text"):
+                        st.write(f"- {p.get('text')}")
+
+
+def _render_results(normalized: List[dict]) -> None:
+    st.markdown("### 📋 Results")
+
+    # Show POSSIBLY ELIGIBLE first; collapse INELIGIBLE by default
+    possible = [x for x in normalized if x["elig"] == "POSSIBLY ELIGIBLE"]
+    ineligible = [x for x in normalized if x["elig"] == "INELIGIBLE"]
+
+    if not possible:
+        st.info(
+            "No eligible trials found in the current dataset. Please relax your search criteria."
+        )
+
+    # Show possibly eligible first
+    for item in possible:
+        _render_card(item)
+
+    # Hidden ineligible section
+    if ineligible:
+        with st.expander(
+            f"Show ineligible trials ({len(ineligible)})", expanded=False
+        ):
+            for item in ineligible:
+                _render_card(item)
+
+
+def main() -> None:
+    # ---------- Page config ----------
+    st.set_page_config(
+        page_title="TrialGPT",
+        page_icon="🏥",
+        layout="centered",
+        initial_sidebar_state="collapsed",
+    )
+
+    # ---------- Styles ----------
+    st.markdown(_STYLE_CSS, unsafe_allow_html=True)
 
     # ---------- Search Card (header + input + tips) ----------
     st.markdown("<h1>🏥 TrialGPT</h1>", unsafe_allow_html=True)
@@ -140,13 +359,12 @@ def main() -> None:
 
     location_facets = _load_location_facets()
 
-    age_options = _make_options(range(0, 121))
-    sel_age = _selectbox_with_reset("Age", age_options, key="filter_age")
-
-    sex_options = _make_options(["FEMALE", "MALE"])
-    sel_sex = _selectbox_with_reset("Sex", sex_options, key="filter_sex")
+    sel_age = _selectbox_with_reset("Age", _AGE_OPTIONS, key="filter_age")
+    sel_sex = _selectbox_with_reset("Sex", _SEX_OPTIONS, key="filter_sex")
 
-    country_options = _make_options(location_facets.get("countries", []))
+    country_options = _make_options_cached(
+        tuple(location_facets.get("countries", []))
+    )
     sel_country = _selectbox_with_reset(
         "Country", country_options, key="filter_country"
     )
@@ -157,7 +375,7 @@ def main() -> None:
         if sel_country_key
         else []
     )
-    state_options = _make_options(states)
+    state_options = _make_options_cached(tuple(states))
     sel_state = _selectbox_with_reset(
         "State / Province",
         state_options,
@@ -172,7 +390,7 @@ def main() -> None:
         if sel_country_key
         else []
     )
-    city_options = _make_options(cities)
+    city_options = _make_options_cached(tuple(cities))
     sel_city = _selectbox_with_reset(
         "City",
         city_options,
@@ -197,17 +415,20 @@ Describe the patient's condition(s), therapies of interest, and any additional p
             "🔍 Search Clinical Trials", use_container_width=True, type="primary"
         )
 
-    st.markdown(
-        """
-<div class="search-tips">
-  <strong>💡 Tips:</strong> Any text format is acceptable (full sentences, bullets, etc.).
-</div>
-""",
-        unsafe_allow_html=True,
-    )
+    st.markdown(_TIPS_HTML, unsafe_allow_html=True)
 
     # ---------- Results (only after click) ----------
+    # Stashed results are only valid for the text and filters that produced them
+    search_inputs = (
+        " ".join((search_query or "").split()),
+        sel_age,
+        sel_sex,
+        sel_country,
+        sel_state,
+        sel_city,
+    )
     if submitted:
+        st.session_state.pop(_RESULTS_KEY, None)
         if not (search_query or "").strip():
             st.warning("Please enter a description to search.")
             return
@@ -219,12 +440,10 @@ Describe the patient's condition(s), therapies of interest, and any additional p
 
         # Large centered loading indicator shown inline (not blocking)
         loader = st.empty()
-        loader.markdown(
-            "<div class='loading-box'><div class='spinner'></div></div>",
-            unsafe_allow_html=True,
-        )
+        loader.markdown(_LOADER_HTML, unsafe_allow_html=True)
 
-        spec = parse(search_query)
+        # cache_data hands back a copy, so filter overrides below never leak into the cache
+        spec = _parse_cached(" ".join(search_query.split()))
 
         if sel_age is not None:
             spec["age"] = int(sel_age)
@@ -243,159 +462,53 @@ Describe the patient's condition(s), therapies of interest, and any additional p
         if any(location_payload.values()):
             spec["location"] = location_payload
 
-        grouped = retrieve_with_exclusions(spec, max_trials=10)
+        # No scripted triage before the judge: age/sex already filter trials in
+        # the Qdrant query (retrieval.build_filters), and a keyword gate over
+        # the embedding-ranked shortlist would drop synonym matches ("NSCLC"
+        # vs "lung cancer"), trading recall for a few skipped judge calls.
+        grouped = _retrieve_cached(_SPEC_KEY_ENCODER.encode(spec), 10)
         if not grouped:
             loader.empty()
             st.info(
                 "No eligible trials found in the current dataset. Please relax your search criteria."
             )
             return
-        judged = judge_grouped(spec, grouped)
-        loader.empty()
+        from clinical_rag.judge import judge_grouped_async
 
-        st.markdown("### 📋 Results")
+        judged = asyncio.run(judge_grouped_async(spec, grouped))
+        loader.empty()
 
         if not judged:
+            st.markdown("### 📋 Results")
             st.info(
                 "No eligible trials found in the current dataset. Please relax your search criteria."
             )
             return
 
-        # Build normalized objects for consistent rendering
-        normalized = []
-        for j in judged:
-            nct = j.get("nct_id")
-            ctx = grouped.get(nct, {}) if isinstance(grouped, dict) else {}
-
-            # representative payload (prefer first inclusion, else first exclusion)
-            rep = None
-            for h in ctx.get("incl", []) + ctx.get("excl", []):
-                rep = h.payload or {}
-                if rep:
-                    break
-
-            title = (rep or {}).get("trial_title") or nct or "Untitled Trial"
-            url = (rep or {}).get("url")
-            elig = (j.get("eligibility") or "").upper()
-            status = (rep or {}).get("overall_status") or ""
-            phase = (rep or {}).get("phase") or ""
-            study_type = (rep or {}).get("study_type") or ""
-
-            normalized.append(
-                {
-                    "nct": nct,
-                    "title": title,
-                    "elig": elig,
-                    "status": status,
-                    "phase": phase,
-                    "study_type": study_type,
-                    "url": url,
-                    "ctx": ctx,
-                    "judge": j,
-                }
-            )
-
-        # Show POSSIBLY ELIGIBLE first; collapse INELIGIBLE by default
-        possible = [x for x in normalized if x["elig"] == "POSSIBLY ELIGIBLE"]
-        ineligible = [x for x in normalized if x["elig"] == "INELIGIBLE"]
-
-        if not possible:
-            st.info(
-                "No eligible trials found in the current dataset. Please relax your search criteria."
-            )
-
-        def render_card(item):
-            j = item["judge"]
-            ctx = item["ctx"]
-
-            with st.container(border=True):
-                st.markdown(
-                    f"**{item['title']}** "
-                    f"<span class='elig-{item['elig'].replace(' ', '_')}'>{item['elig']}</span>",
-                    unsafe_allow_html=True,
-                )
-
-                meta_bits = []
-                if item["status"]:
-                    meta_bits.append(f"<span class='badge'>{item['status']}</span>")
-                if item["phase"]:
-                    meta_bits.append(f"<span class='badge'>{item['phase']}</span>")
-                if item["study_type"]:
-                    meta_bits.append(f"<span class='badge'>{item['study_type']}</span>")
-                if meta_bits:
-                    st.markdown(
-                        "<div class='meta'>" + " ".join(meta_bits) + "</div>",
-                        unsafe_allow_html=True,
-                    )
-
-                if item["url"]:
-                    st.caption(item["url"])
-
-                # Locations (expander, semicolon-separated list of all sites)
-                locs = (rep or {}).get("locations") or []
-                with st.expander("Locations", expanded=False):
-                    if isinstance(locs, list) and locs:
-                        items = []
-                        for l in locs:
-                            if not isinstance(l, dict):
-                                continue
-                            city = (l.get("city") or "").strip()
-                            state = (l.get("state") or "").strip()
-                            country = (l.get("country") or "").strip()
-                            parts = [p for p in [city, state, country] if p]
-                            if parts:
-                                items.append(", ".join(parts))
-                        if items:
-                            st.write("; ".join(items))
-                        else:
-                            st.write("No locations listed.")
-                    else:
-                        st.write("No locations listed.")
-
-                explanation = j.get("explanation") or ""
-                if explanation:
-                    st.write("Explanation:")
-                    st.write(explanation)
-
-                # Full criteria expander
-                with st.expander("All eligibility criteria", expanded=False):
-                    col_in, col_ex = st.columns(2)
-                    with col_in:
-                        st.caption("Inclusion")
-                        for h in ctx.get("incl", []):
-                            p = h.payload or {}
-                            if p.get("text"):
-                                st.write(f"- {p.get('text')}")
-                    with col_ex:
-                        st.caption("Exclusion")
-                        for h in ctx.get("excl", []):
-                            p = h.payload or {}
-                            if p.get("text"):
-                                st.write(f"- {p.get('text')}")
-
-        # Show possibly eligible first
-        for item in possible:
-            render_card(item)
-
-        # Hidden ineligible section
-        if ineligible:
-            with st.expander(
-                f"Show ineligible trials ({len(ineligible)})", expanded=False
-            ):
-                for item in ineligible:
-                    render_card(item)
+        normalized = _normalize_results(judged, grouped)
+        st.session_state[_RESULTS_KEY] = {
+            "inputs": search_inputs,
+            "query": search_query,
+            "spec": spec,
+            "grouped": grouped,
+            "judged": judged,
+            "normalized": normalized,
+        }
+        _render_results(normalized)
+    elif _RESULTS_KEY in st.session_state:
+        last = st.session_state[_RESULTS_KEY]
+        if last["inputs"] == search_inputs:
+            # Widget reruns (e.g. opening an expander) keep showing the last
+            # results instead of running parse/retrieve/judge again
+            _render_results(last["normalized"])
+        else:
+            # Changed text or filters: don't present old matches as current
+            st.session_state.pop(_RESULTS_KEY, None)
+            st.info("Search inputs changed. Submit again to refresh the results.")
 
     # ---------- Footer ----------
     st.markdown("---")
-    st.markdown(
-        """
-<div style="text-align: center; color: #6c757d; padding: 1rem 0 2rem;">
-  <p>This tool is for informational purposes only. Always consult a healthcare professional.</p>
-  <p><small>Data sourced from ClinicalTrials.gov (Snapshot: September 19, 2025)</small></p>
-</div>
-""",
-        unsafe_allow_html=True,
-    )
+    st.markdown(_FOOTER_HTML, unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
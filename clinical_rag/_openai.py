@@ -0,0 +1,107 @@
+"""Shared OpenAI client for the parser, judge and eval scripts.
+
+A single process-wide client means chained calls (parse -> retrieve -> judge)
+reuse one pooled HTTP transport instead of each paying a fresh TLS handshake.
+The transport speaks HTTP/2 when `h2` is installed, so concurrent requests are
+multiplexed over one connection. The API key is checked here, when a client is
+built, rather than on every call.
+"""
+
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+
+# httpx needs the optional `h2` package for HTTP/2 (pulled in via httpx[http2])
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Bound tail latency: the SDK retries timeouts, connection errors, 429s and 5xx
+# with exponential backoff + jitter. The timeout applies per request (and per
+# read while streaming), so one stuck call can't stall a whole batch.
+_TIMEOUT_S = 30.0
+_MAX_RETRIES = 5
+# Fail fast on an unreachable endpoint; retries handle the reconnect
+_TIMEOUT = httpx.Timeout(_TIMEOUT_S, connect=5.0)
+# Sized for the eval scripts' default 16-way concurrency with headroom. Over
+# HTTP/2 these calls multiplex onto a few connections; the caps only bound
+# HTTP/1.1 fallback and idle keep-alive sockets.
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+
+def require_api_key() -> None:
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise RuntimeError("OPENAI_API_KEY is required for LLM calls")
+
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenAI:
+    """Return the process-wide client, building it on first use.
+
+    Double-checked under a lock so parser/judge threads racing on the first
+    call share one client (and one connection pool) instead of each building
+    their own.
+    """
+    global _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                # Raising here leaves _client unset, so a key set later
+                # (e.g. load_dotenv) still works
+                require_api_key()
+                _client = OpenAI(
+                    http_client=DefaultHttpxClient(http2=_HTTP2, limits=_LIMITS),
+                    timeout=_TIMEOUT,
+                    max_retries=_MAX_RETRIES,
+                )
+            client = _client
+    return client
+
+
+def new_async_client() -> AsyncOpenAI:
+    """Build an AsyncOpenAI client; scope it to one event loop (`async with`)."""
+    require_api_key()
+    return AsyncOpenAI(
+        http_client=DefaultAsyncHttpxClient(http2=_HTTP2, limits=_LIMITS),
+        timeout=_TIMEOUT,
+        max_retries=_MAX_RETRIES,
+    )
+
+
+class AsyncRateLimiter:
+    """Token bucket allowing at most `rate` units per `period` seconds.
+
+    `acquire()` takes one unit (requests per minute); pass an estimated token
+    count as `amount` to throttle tokens per minute with a second bucket.
+    """
+
+    def __init__(self, rate: float, period: float = 60.0):
+        self._capacity = max(1.0, float(rate))
+        self._tokens = self._capacity
+        self._fill_rate = self._capacity / period
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # A single request larger than the bucket waits for a full bucket
+        amount = min(float(amount), self._capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._last) * self._fill_rate
+                )
+                self._last = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self._fill_rate)
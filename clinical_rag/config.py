@@ -6,6 +6,7 @@ sprinkling os.getenv calls across modules.
 
 from dataclasses import dataclass
 from datetime import date
+from functools import lru_cache
 import os
 from typing import Optional
 
@@ -21,47 +22,85 @@ def _parse_date(name: str) -> Optional[date]:
         return None
 
 
+def _parse_int(name: str) -> Optional[int]:
+    value = os.getenv(name, "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
 @dataclass(frozen=True)
 class Settings:
     openai_api_key: Optional[str]
     qdrant_url: str
+    qdrant_grpc_port: int
     collection_name: str
     data_start_date: Optional[date]
     data_end_date: Optional[date]
     ctgov_api_base: str
     embedding_model_name: str
+    embedding_threads: Optional[int]
+    embedding_dim_truncate: Optional[int]
     llm_model_name: str
-    allowed_statuses: list[str]
+    query_parser_stream: bool
+    allowed_statuses: frozenset[str]
 
 
-DEFAULT_ALLOWED_STATUSES = [
-    "RECRUITING",
-    "ENROLLING_BY_INVITATION",
-    "NOT_YET_RECRUITING",
-    "ACTIVE_NOT_RECRUITING",
-]
+DEFAULT_ALLOWED_STATUSES = frozenset(
+    {
+        "RECRUITING",
+        "ENROLLING_BY_INVITATION",
+        "NOT_YET_RECRUITING",
+        "ACTIVE_NOT_RECRUITING",
+    }
+)
 
 DEFAULT_EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
 DEFAULT_LLM_MODEL_NAME = "gpt-4o"
 
 
+@lru_cache(maxsize=1)
 def load_settings() -> Settings:
     """Load settings from environment with sensible defaults.
 
+    The result is cached for the life of the process; call
+    `load_settings.cache_clear()` after changing the environment (e.g. after
+    `load_dotenv()` or in tests that set env vars). Modules call this at use
+    time rather than binding settings at import, so a cleared cache reaches
+    them.
+
     Notes:
     - Allowed statuses are configured in code via DEFAULT_ALLOWED_STATUSES.
     - Embedding model name is configured in code via DEFAULT_EMBEDDING_MODEL_NAME.
+      FastEmbed already serves it as an INT8-quantized ONNX export.
+    - EMBEDDING_THREADS caps ONNX Runtime intra-op threads (unset = runtime default).
+    - EMBEDDING_DIM_TRUNCATE keeps only the leading dims of each vector
+      (Matryoshka). Only meaningful for MRL-trained models, and the collection
+      must be built at the same dim.
+    - QP_STREAM=1 makes the query parser stream its completion and stop reading
+      once the JSON spec closes.
     """
     return Settings(
         openai_api_key=os.getenv("OPENAI_API_KEY") or None,
         qdrant_url=os.getenv("QDRANT_URL", "http://localhost:6333"),
+        qdrant_grpc_port=_parse_int("QDRANT_GRPC_PORT") or 6334,
         collection_name=os.getenv("COLLECTION_NAME", "clinical_trials"),
         data_start_date=_parse_date("DATA_START_DATE"),
         data_end_date=_parse_date("DATA_END_DATE"),
         ctgov_api_base=os.getenv("CTGOV_API_BASE", "https://clinicaltrials.gov/api/v2"),
         embedding_model_name=DEFAULT_EMBEDDING_MODEL_NAME,
+        embedding_threads=_parse_int("EMBEDDING_THREADS"),
+        embedding_dim_truncate=_parse_int("EMBEDDING_DIM_TRUNCATE"),
         llm_model_name=os.getenv("LLM_MODEL_NAME", DEFAULT_LLM_MODEL_NAME),
-        allowed_statuses=DEFAULT_ALLOWED_STATUSES,
+        query_parser_stream=_parse_flag("QP_STREAM"),
+        allowed_statuses=frozenset(DEFAULT_ALLOWED_STATUSES),
     )
 
 
@@ -0,0 +1,97 @@
+"""Lenient JSON extraction from raw LLM output.
+
+Shared by the query parser and the judge: tries the raw text, then the text
+with a surrounding markdown ``` / ```json fence removed, then the slice
+between the first opening and last closing bracket. `JsonEndTracker` finds
+where a streamed JSON value ends so callers can stop reading early.
+"""
+
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Union
+
+_FENCE_OPEN = re.compile(r"^```(?:json)?\s*", re.IGNORECASE)
+_FENCE_CLOSE = re.compile(r"\s*```$")
+_DECODER = json.JSONDecoder()
+
+
+def strip_fences(s: str) -> str:
+    """Remove a surrounding markdown ``` / ```json block, if present."""
+    s = s.strip()
+    if s.startswith("```") and s.endswith("```"):
+        s = _FENCE_OPEN.sub("", s)
+        s = _FENCE_CLOSE.sub("", s)
+    return s.strip()
+
+
+def _candidates(text: str, open_ch: str, close_ch: str) -> Iterator[str]:
+    # Lazy, so well-formed output (the common case) skips the fence regexes
+    yield text
+    stripped = strip_fences(text)
+    if stripped != text:
+        yield stripped
+    start = text.find(open_ch)
+    end = text.rfind(close_ch)
+    if start != -1 and end > start:
+        sliced = text[start : end + 1]
+        if sliced != text and sliced != stripped:
+            yield sliced
+
+
+def _parse_json(
+    text: str, open_ch: str, close_ch: str, kind: type
+) -> Optional[Union[Dict, List]]:
+    for candidate in _candidates(text, open_ch, close_ch):
+        try:
+            obj = _DECODER.decode(candidate)
+        except ValueError:
+            continue
+        if isinstance(obj, kind):
+            return obj
+    return None
+
+
+def parse_json_object(text: str) -> Optional[Dict]:
+    """Best-effort parse of a JSON object from `text`; None when none is found."""
+    return _parse_json(text, "{", "}", dict)
+
+
+def parse_json_array(text: str) -> Optional[List]:
+    """Best-effort parse of a JSON array from `text`; None when none is found."""
+    return _parse_json(text, "[", "]", list)
+
+
+class JsonEndTracker:
+    """Tracks bracket depth over streamed chunks, ignoring brackets inside strings.
+
+    `feed` returns the offset just past the character that closes the first
+    top-level JSON object/array (so the caller can stop reading), else -1.
+    """
+
+    __slots__ = ("depth", "started", "in_str", "escape")
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.started = False
+        self.in_str = False
+        self.escape = False
+
+    def feed(self, chunk: str) -> int:
+        for i, ch in enumerate(chunk):
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "{[":
+                self.depth += 1
+                self.started = True
+            elif ch in "}]":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    return i + 1
+        return -1
@@ -5,53 +5,381 @@ CLI:
 """
 
 import argparse
+import asyncio
+from collections import OrderedDict
+import hashlib
+import io
 import json
-import os
-import re
-from functools import lru_cache
-from typing import Dict, List, Optional
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from openai import OpenAI
+from openai import AsyncOpenAI, BadRequestError, OpenAI
 
 from clinical_rag.query_parser import parse
 from clinical_rag.retrieval import retrieve_with_exclusions
 from clinical_rag.prompts.judge_prompt import SYSTEM_PROMPT
 from clinical_rag.config import load_settings
+from clinical_rag._openai import get_client, new_async_client
+from clinical_rag.jsonutil import JsonEndTracker, parse_json_array
 
 
-@lru_cache(maxsize=1)
-def _get_client() -> OpenAI:
-    return OpenAI()
+def _default_model() -> str:
+    return load_settings().llm_model_name
 
 
-_SETTINGS = load_settings()
+# Shared fallback for hits without a payload; never mutated
+_EMPTY: Dict = {}
+
+
+# Approximate input-token budget for the trial context of one judge prompt, so
+# prompt size stays roughly flat however many trials are packed into it.
+_CONTEXT_TOKEN_BUDGET = 6000
+# Bullets every trial keeps even when the budget is tight
+_MIN_BULLETS_PER_TRIAL = 8
+
+
+def _est_tokens(chunk_id: object, text: object) -> int:
+    # ~4 characters per token for English text; close enough for budgeting
+    return (len(str(chunk_id)) + len(str(text)) + 6) // 4 + 1
+
+
+# Parallel (ids, texts) tuples precomputed by retrieval, keyed by bullet side
+_BULLET_KEYS = {
+    "incl": ("incl_ids", "incl_texts"),
+    "excl": ("excl_ids", "excl_texts"),
+}
+
+
+def _bullets(ctx: Dict, side: str, limit: int) -> Tuple[Sequence, Sequence]:
+    """Return up to `limit` (chunk_ids, texts) for the "incl" or "excl" side.
+
+    Uses the tuples retrieval precomputes when present; otherwise reads them
+    off the hit payloads (e.g. for hand-built `grouped` dicts).
+    """
+    ids_key, texts_key = _BULLET_KEYS[side]
+    ids = ctx.get(ids_key)
+    if ids is not None:
+        return ids[:limit], ctx[texts_key][:limit]
+    payloads = [
+        getattr(h, "payload", None) or _EMPTY for h in ctx.get(side, [])[:limit]
+    ]
+    return [p.get("chunk_id") for p in payloads], [p.get("text") for p in payloads]
+
+
+def _budget_bullet_counts(
+    bullets: Dict[str, Tuple[Tuple[Sequence, Sequence], Tuple[Sequence, Sequence]]],
+    token_budget: Optional[int],
+) -> Dict[str, Tuple[int, int]]:
+    """Return (n_incl, n_excl) bullets to keep per trial under `token_budget`.
+
+    The budget is split across trials in proportion to their bullet volume;
+    within a trial, inclusion and exclusion bullets are taken alternately so
+    neither side is starved. Each trial keeps at least _MIN_BULLETS_PER_TRIAL.
+    """
+    costs: Dict[str, Tuple[List[int], List[int]]] = {}
+    for nct_id, ((incl_ids, incl_texts), (excl_ids, excl_texts)) in bullets.items():
+        incl = [_est_tokens(c, t) for c, t in zip(incl_ids, incl_texts)]
+        excl = [_est_tokens(c, t) for c, t in zip(excl_ids, excl_texts)]
+        costs[nct_id] = (incl, excl)
+
+    total = sum(sum(incl) + sum(excl) for incl, excl in costs.values())
+    if token_budget is None or total <= token_budget:
+        return {
+            nct_id: (len(incl), len(excl)) for nct_id, (incl, excl) in costs.items()
+        }
+
+    counts: Dict[str, Tuple[int, int]] = {}
+    for nct_id, (incl, excl) in costs.items():
+        share = token_budget * (sum(incl) + sum(excl)) / total
+        order: List[Tuple[int, int]] = []
+        for k in range(max(len(incl), len(excl))):
+            if k < len(incl):
+                order.append((0, incl[k]))
+            if k < len(excl):
+                order.append((1, excl[k]))
+        kept = [0, 0]
+        used = 0
+        for n, (side, cost) in enumerate(order):
+            if n >= _MIN_BULLETS_PER_TRIAL and used + cost > share:
+                break
+            kept[side] += 1
+            used += cost
+        counts[nct_id] = (kept[0], kept[1])
+    return counts
+
+
+def _write_bullets(write, ids: Sequence, texts: Sequence) -> None:
+    for chunk_id, text in zip(ids, texts):
+        write("- [")
+        write(str(chunk_id))
+        write("] ")
+        write(str(text))
+        write("\n")
 
 
 def _fmt_all_trials_context(
-    grouped: Dict[str, Dict[str, List]], *, max_incl: int = 40, max_excl: int = 40
+    grouped: Dict[str, Dict[str, List]],
+    *,
+    max_incl: int = 40,
+    max_excl: int = 40,
+    token_budget: Optional[int] = _CONTEXT_TOKEN_BUDGET,
 ) -> str:
-    parts: List[str] = []
+    """Format trials for the judge prompt; `token_budget=None` disables cropping."""
+    bullets = {
+        nct_id: (_bullets(ctx, "incl", max_incl), _bullets(ctx, "excl", max_excl))
+        for nct_id, ctx in grouped.items()
+    }
+    counts = _budget_bullet_counts(bullets, token_budget)
+    buf = io.StringIO()
+    write = buf.write
     for nct_id, ctx in grouped.items():
-        parts.append(f"TRIAL: {nct_id}")
-        info = ctx.get("info", {})
+        write(f"TRIAL: {nct_id}\n")
+        info = ctx.get("info") or _EMPTY
         title = info.get("trial_title") or ""
         conditions = info.get("conditions") or []
         if title:
-            parts.append(f"Title: {title}")
+            write(f"Title: {title}\n")
         if conditions:
             joined_conditions = ", ".join([str(c) for c in conditions if c])
             if joined_conditions:
-                parts.append(f"Conditions: {joined_conditions}")
-        parts.append("Inclusion bullets:")
-        for h in ctx.get("incl", [])[:max_incl]:
-            p = h.payload or {}
-            parts.append(f"- [{p.get('chunk_id')}] {p.get('text')}")
-        parts.append("Exclusion bullets:")
-        for h in ctx.get("excl", [])[:max_excl]:
-            p = h.payload or {}
-            parts.append(f"- [{p.get('chunk_id')}] {p.get('text')}")
-        parts.append("")
-    return "\n".join(parts)
+                write(f"Conditions: {joined_conditions}\n")
+        (incl_ids, incl_texts), (excl_ids, excl_texts) = bullets[nct_id]
+        n_incl, n_excl = counts[nct_id]
+        write("Inclusion bullets:\n")
+        _write_bullets(write, incl_ids[:n_incl], incl_texts[:n_incl])
+        write("Exclusion bullets:\n")
+        _write_bullets(write, excl_ids[:n_excl], excl_texts[:n_excl])
+        write("\n")
+    # Match the previous "\n".join(parts) output, which had no trailing newline
+    return buf.getvalue()[:-1]
+
+
+_SCHEMA_NOTE = (
+    'Return ONLY a JSON object of the form {"verdicts": [...]} where each item has keys: '
+    "nct_id, eligibility ('POSSIBLY ELIGIBLE'|'INELIGIBLE'), explanation (string)."
+)
+# Static per process; built once instead of on every judge call. Every judge
+# prompt starts with a fixed system message followed by the patient spec, so
+# OpenAI's automatic prompt caching can reuse that prefix across calls (prompts
+# >= 1024 tokens). The cache key routes judge requests to the same cache.
+_SYSTEM_MSG = SYSTEM_PROMPT + "\n" + _SCHEMA_NOTE
+_PROMPT_CACHE_KEY = "trialgpt-judge"
+# JSON mode: the model must return one JSON object (hence {"verdicts": [...]})
+_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+# Reused encoders: json.dumps with non-default options builds a new encoder per call
+_SPEC_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+_KEY_ENCODER = json.JSONEncoder(ensure_ascii=False, sort_keys=True)
+
+
+def _spec_json(spec: Dict) -> str:
+    return _SPEC_ENCODER.encode(spec)
+
+
+def _judge_messages(
+    spec: Dict,
+    grouped: Dict[str, Dict[str, List]],
+    *,
+    spec_json: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """Build the system + user chat messages for judging `grouped` trials.
+
+    Pass a precomputed `spec_json` to avoid re-serializing the same patient.
+    """
+    if spec_json is None:
+        spec_json = _spec_json(spec)
+    user_content = (
+        f"Patient spec JSON:\n{spec_json}\n\n{_fmt_all_trials_context(grouped)}"
+    )
+    return [
+        {"role": "system", "content": _SYSTEM_MSG},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def judge_request_body(
+    spec: Dict, grouped: Dict[str, Dict[str, List]], model: str
+) -> Dict:
+    """Return the JSON-mode chat completion body used to judge `grouped` trials.
+
+    For callers that send the request themselves (e.g. the Batch API).
+    """
+    return {
+        "model": model,
+        "messages": _judge_messages(spec, grouped),
+        "temperature": 0,
+        "prompt_cache_key": _PROMPT_CACHE_KEY,
+        "response_format": _RESPONSE_FORMAT,
+    }
+
+
+def _normalize_verdicts(parsed: List) -> List[Dict]:
+    """Normalize eligibility labels and explanations on parsed verdict dicts."""
+    data = []
+    for item in parsed or []:
+        try:
+            elig_raw = str(item.get("eligibility", "")).strip().upper()
+            item["eligibility"] = (
+                "INELIGIBLE" if elig_raw == "INELIGIBLE" else "POSSIBLY ELIGIBLE"
+            )
+            if not isinstance(item.get("explanation"), str):
+                item["explanation"] = str(item.get("explanation", ""))
+        except Exception:
+            item["eligibility"] = "POSSIBLY ELIGIBLE"
+        data.append(item)
+    return data
+
+
+def parse_verdicts(content: str) -> List[Dict]:
+    """Parse the judge's {"verdicts": [...]} output and normalize eligibility labels."""
+    try:
+        obj = json.loads(content)
+    except ValueError:
+        obj = None
+    if isinstance(obj, dict):
+        obj = obj.get("verdicts")
+    if not isinstance(obj, list):
+        # Safety net for fenced or chatty output; JSON mode should make this rare
+        obj = parse_json_array(content) or []
+    return _normalize_verdicts(obj)
+
+
+def _complete(client: OpenAI, messages: List[Dict[str, str]], model: str) -> str:
+    """Run one streamed JSON-mode judge completion and return the raw content.
+
+    Reading stops as soon as the top-level JSON value closes.
+    """
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0,
+        prompt_cache_key=_PROMPT_CACHE_KEY,
+        response_format=_RESPONSE_FORMAT,
+        stream=True,
+    )
+    parts: List[str] = []
+    tracker = JsonEndTracker()
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                end = tracker.feed(delta)
+                if end >= 0:
+                    parts.append(delta[:end])
+                    break
+                parts.append(delta)
+    finally:
+        stream.close()
+    return "".join(parts) or "{}"
+
+
+async def _acomplete(
+    client: AsyncOpenAI, messages: List[Dict[str, str]], model: str
+) -> str:
+    """Async counterpart of `_complete`."""
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0,
+        prompt_cache_key=_PROMPT_CACHE_KEY,
+        response_format=_RESPONSE_FORMAT,
+        stream=True,
+    )
+    parts: List[str] = []
+    tracker = JsonEndTracker()
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                end = tracker.feed(delta)
+                if end >= 0:
+                    parts.append(delta[:end])
+                    break
+                parts.append(delta)
+    finally:
+        await stream.close()
+    return "".join(parts) or "{}"
+
+
+def _pick_verdict(nct_id: str, verdicts: List[Dict]) -> Optional[Dict]:
+    """Return the verdict for `nct_id` from a single-trial judge response."""
+    items = [v for v in verdicts if isinstance(v, dict)]
+    for item in items:
+        if item.get("nct_id") == nct_id:
+            return item
+    # A single-trial prompt may come back without the id echoed
+    if len(items) == 1:
+        items[0]["nct_id"] = nct_id
+        return items[0]
+    return None
+
+
+# Per-trial verdict memo used by judge_one_async. Repeat searches
+# that only change preferences (e.g. location) reuse verdicts for recurring trials.
+_VERDICT_CACHE_SIZE = 1024
+_VERDICT_SPEC_KEYS = ("age", "sex", "conditions", "medications", "extra_terms")
+_verdict_cache: "OrderedDict[Tuple[str, str, str, str], Dict]" = OrderedDict()
+_verdict_cache_lock = threading.Lock()
+_verdict_stats = {"hits": 0, "misses": 0}
+
+
+def _verdict_key(
+    spec: Dict, nct_id: str, ctx: Dict[str, List], model_name: str
+) -> Tuple[str, str, str, str]:
+    """Key a verdict on the trial context text and eligibility-relevant spec fields."""
+    context = _fmt_all_trials_context({nct_id: ctx})
+    relevant = {k: spec.get(k) for k in _VERDICT_SPEC_KEYS}
+    return (
+        model_name,
+        nct_id,
+        hashlib.sha1(context.encode("utf-8")).hexdigest(),
+        _KEY_ENCODER.encode(relevant),
+    )
+
+
+def _verdict_cache_get(key: Tuple[str, str, str, str]) -> Optional[Dict]:
+    with _verdict_cache_lock:
+        verdict = _verdict_cache.get(key)
+        if verdict is None:
+            _verdict_stats["misses"] += 1
+            return None
+        _verdict_cache.move_to_end(key)
+        _verdict_stats["hits"] += 1
+        return dict(verdict)
+
+
+def _verdict_cache_put(key: Tuple[str, str, str, str], verdict: Dict) -> None:
+    with _verdict_cache_lock:
+        _verdict_cache[key] = dict(verdict)
+        _verdict_cache.move_to_end(key)
+        while len(_verdict_cache) > _VERDICT_CACHE_SIZE:
+            _verdict_cache.popitem(last=False)
+
+
+def get_stats() -> Dict[str, float]:
+    """Return verdict-cache hit/miss counters for the current process."""
+    with _verdict_cache_lock:
+        hits, misses = _verdict_stats["hits"], _verdict_stats["misses"]
+        size = len(_verdict_cache)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "size": size,
+        "hit_rate": (hits / total) if total else 0.0,
+    }
+
+
+def clear_verdict_cache() -> None:
+    with _verdict_cache_lock:
+        _verdict_cache.clear()
+        _verdict_stats["hits"] = 0
+        _verdict_stats["misses"] = 0
 
 
 def judge_from_text(
@@ -60,97 +388,48 @@ def judge_from_text(
     max_trials: int = 10,
     model: Optional[str] = None,
     verbose: bool = False,
+    spec: Optional[Dict] = None,
+    grouped: Optional[Dict[str, Dict[str, List]]] = None,
 ) -> List[Dict]:
-    """Single LLM call that judges all shortlisted trials (up to max_trials) in one response."""
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is required for LLM judging")
+    """Single LLM call that judges all shortlisted trials (up to max_trials) in one response.
 
-    spec = parse(text)
-    grouped = retrieve_with_exclusions(spec, max_trials=max_trials)
+    Pass `spec` (and optionally `grouped`) to skip the parse call and/or
+    retrieval when the caller already has them, e.g. batch jobs that parse
+    every patient up front.
+    """
+
+    if spec is None:
+        spec = parse(text)
+    if grouped is None:
+        grouped = retrieve_with_exclusions(spec, max_trials=max_trials)
 
+    spec_json = _spec_json(spec)
     if verbose:
         print("[judge] Parsed spec:")
-        print(json.dumps(spec, ensure_ascii=False, indent=2))
+        print(spec_json)
         print("[judge] Selected trials and bullet counts:")
         for nct_id, ctx in grouped.items():
             print(
                 f"  - {nct_id}: incl={len(ctx.get('incl', []))}, excl={len(ctx.get('excl', []))}"
             )
 
-    client = _get_client()
-    user_content = (
-        "Patient spec JSON:\n"
-        + json.dumps(spec, ensure_ascii=False)
-        + "\n\n"
-        + _fmt_all_trials_context(grouped)
-    )
-    schema_note = (
-        "Return ONLY a JSON array of objects, each with keys: "
-        "nct_id, eligibility ('POSSIBLY ELIGIBLE'|'INELIGIBLE'), explanation (string)."
-    )
+    client = get_client()
+    messages = _judge_messages(spec, grouped, spec_json=spec_json)
     if verbose:
         print("[judge] Prompt context to LLM (system + user):")
         print("--- SYSTEM ---")
-        print(SYSTEM_PROMPT + "\n" + schema_note)
+        print(messages[0]["content"])
         print("--- USER ---")
-        print(user_content)
-
-    model_name = model or _SETTINGS.llm_model_name
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT + "\n" + schema_note},
-            {"role": "user", "content": user_content},
-        ],
-        temperature=0,
-    )
-    content = resp.choices[0].message.content or "[]"
+        print(messages[1]["content"])
+
+    model_name = model or _default_model()
+    content = _complete(client, messages, model_name)
     if verbose:
         print("[judge] Raw LLM output:")
         print(content)
 
-    # Be robust to markdown code fences
-    def _strip_fences(s: str) -> str:
-        s = s.strip()
-        # Remove leading/trailing ``` blocks if present
-        if s.startswith("```") and s.endswith("```"):
-            s = re.sub(r"^```(?:json)?\s*", "", s, flags=re.IGNORECASE)
-            s = re.sub(r"\s*```$", "", s)
-        return s.strip()
-
-    parsed: List[Dict] = []
-    candidates_to_try = [content, _strip_fences(content)]
-    # Heuristic: try extracting between first '[' and last ']'
-    try:
-        start = content.find("[")
-        end = content.rfind("]")
-        if start != -1 and end != -1 and end > start:
-            candidates_to_try.append(content[start : end + 1])
-    except Exception:
-        pass
-    for candidate in candidates_to_try:
-        try:
-            obj = json.loads(candidate)
-            if isinstance(obj, list):
-                parsed = obj
-                break
-        except Exception:
-            continue
-    # Normalize to policy and sanitize keys
-    data = []
-    for item in parsed or []:
-        try:
-            elig_raw = str(item.get("eligibility", "")).strip().upper()
-            item["eligibility"] = (
-                "INELIGIBLE" if elig_raw == "INELIGIBLE" else "POSSIBLY ELIGIBLE"
-            )
-            if not isinstance(item.get("explanation"), str):
-                item["explanation"] = str(item.get("explanation", ""))
-        except Exception:
-            item["eligibility"] = "POSSIBLY ELIGIBLE"
-        data.append(item)
     # Optionally, we could post-validate that nct_ids exist in grouped
-    return data
+    return parse_verdicts(content)
 
 
 def judge_grouped(
@@ -166,82 +445,200 @@ def judge_grouped(
     Returns an array of trial verdicts with keys:
     nct_id, eligibility, explanation, violated_inclusion_ids, blocking_exclusion_ids.
     """
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is required for LLM judging")
 
+    spec_json = _spec_json(spec)
     if verbose:
         print("[judge_grouped] Parsed spec:")
-        print(json.dumps(spec, ensure_ascii=False, indent=2))
+        print(spec_json)
         print("[judge_grouped] Trials to judge and bullet counts:")
         for nct_id, ctx in grouped.items():
             print(
                 f"  - {nct_id}: incl={len(ctx.get('incl', []))}, excl={len(ctx.get('excl', []))}"
             )
 
-    client = _get_client()
-    user_content = (
-        "Patient spec JSON:\n"
-        + json.dumps(spec, ensure_ascii=False)
-        + "\n\n"
-        + _fmt_all_trials_context(grouped)
-    )
-    schema_note = (
-        "Return ONLY a JSON array of objects, each with keys: "
-        "nct_id, eligibility ('POSSIBLY ELIGIBLE'|'INELIGIBLE'), explanation (string)."
-    )
+    client = get_client()
+    messages = _judge_messages(spec, grouped, spec_json=spec_json)
     if verbose:
         print("[judge_grouped] Prompt context to LLM (system + user):")
         print("--- SYSTEM ---")
-        print(SYSTEM_PROMPT + "\n" + schema_note)
+        print(messages[0]["content"])
         print("--- USER ---")
-        print(user_content)
-
-    model_name = model or _SETTINGS.llm_model_name
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT + "\n" + schema_note},
-            {"role": "user", "content": user_content},
-        ],
-        temperature=0,
-    )
-    content = resp.choices[0].message.content or "[]"
+        print(messages[1]["content"])
+
+    model_name = model or _default_model()
+    content = _complete(client, messages, model_name)
     if verbose:
         print("[judge_grouped] Raw LLM output:")
         print(content)
+    return parse_verdicts(content)
+
+
+_BATCH_SCHEMA_NOTE = (
+    "Several patients are given, each under a '### PATIENT <index>' heading with its own trials. "
+    "Judge each patient only against the trials listed under that patient. "
+    'Return ONLY a JSON object of the form {"verdicts": [...]} where each item has keys: '
+    "patient_index (integer), nct_id, eligibility ('POSSIBLY ELIGIBLE'|'INELIGIBLE'), "
+    "explanation (string)."
+)
+_BATCH_SYSTEM_MSG = SYSTEM_PROMPT + "\n" + _BATCH_SCHEMA_NOTE
 
-    def _strip_fences(s: str) -> str:
-        s = s.strip()
-        # Remove leading/trailing ``` blocks if present
-        if s.startswith("```") and s.endswith("```"):
-            s = re.sub(r"^```(?:json)?\s*", "", s, flags=re.IGNORECASE)
-            s = re.sub(r"\s*```$", "", s)
-        return s.strip()
 
-    parsed: List[Dict] = []
-    for candidate in [content, _strip_fences(content)]:
+def _batch_messages(
+    items: Sequence[Tuple[Dict, Dict[str, Dict[str, List]]]],
+) -> List[Dict]:
+    sections = []
+    for idx, (spec, grouped) in enumerate(items):
+        sections.append(
+            f"### PATIENT {idx}\n"
+            "Patient spec JSON:\n"
+            + _spec_json(spec)
+            + "\n\n"
+            + _fmt_all_trials_context(grouped)
+        )
+    return [
+        {"role": "system", "content": _BATCH_SYSTEM_MSG},
+        {"role": "user", "content": "\n".join(sections)},
+    ]
+
+
+def _route_batch_verdicts(
+    content: str, items: Sequence[Tuple[Dict, Dict[str, Dict[str, List]]]]
+) -> List[List[Dict]]:
+    """Split a packed response back into one verdict list per patient."""
+    results: List[List[Dict]] = [[] for _ in items]
+    for item in parse_verdicts(content):
+        if not isinstance(item, dict):
+            continue
         try:
-            obj = json.loads(candidate)
-            if isinstance(obj, list):
-                parsed = obj
-                break
-        except Exception:
+            idx = int(item.pop("patient_index"))
+        except (KeyError, TypeError, ValueError):
             continue
+        if 0 <= idx < len(items) and item.get("nct_id") in items[idx][1]:
+            results[idx].append(item)
+    return results
 
-    # Normalize to policy and sanitize keys
-    data = []
-    for item in parsed or []:
-        try:
-            elig_raw = str(item.get("eligibility", "")).strip().upper()
-            item["eligibility"] = (
-                "INELIGIBLE" if elig_raw == "INELIGIBLE" else "POSSIBLY ELIGIBLE"
+
+def _is_context_overflow(exc: BadRequestError) -> bool:
+    return getattr(exc, "code", None) == "context_length_exceeded" or (
+        "context length" in str(exc).lower()
+    )
+
+
+async def ajudge_batch(
+    items: Sequence[Tuple[Dict, Dict[str, Dict[str, List]]]],
+    *,
+    model: Optional[str] = None,
+    client: Optional[AsyncOpenAI] = None,
+) -> List[List[Dict]]:
+    """Judge several patients in one pack: all `items` share a single LLM call.
+
+    Returns one verdict list per item, in input order, routed back by
+    patient_index. Callers choose the pack size. Overflowing packs are halved and retried, and
+    patients dropped from the response are re-judged via `ajudge_grouped`.
+    """
+    if client is None:
+        async with new_async_client() as own_client:
+            return await ajudge_batch(items, model=model, client=own_client)
+    if not items:
+        return []
+
+    model_name = model or _default_model()
+    try:
+        content = await _acomplete(client, _batch_messages(items), model_name)
+    except BadRequestError as exc:
+        if len(items) <= 1 or not _is_context_overflow(exc):
+            raise
+        mid = len(items) // 2
+        head = await ajudge_batch(items[:mid], model=model_name, client=client)
+        tail = await ajudge_batch(items[mid:], model=model_name, client=client)
+        return head + tail
+    results = _route_batch_verdicts(content, items)
+    for idx, (spec, grouped) in enumerate(items):
+        if grouped and not results[idx]:
+            results[idx] = await ajudge_grouped(
+                spec, grouped, model=model_name, client=client
             )
-            if not isinstance(item.get("explanation"), str):
-                item["explanation"] = str(item.get("explanation", ""))
-        except Exception:
-            item["eligibility"] = "POSSIBLY ELIGIBLE"
-        data.append(item)
-    return data
+    return results
+
+
+async def judge_one_async(
+    spec: Dict,
+    nct_id: str,
+    ctx: Dict[str, List],
+    *,
+    model: Optional[str] = None,
+    client: Optional[AsyncOpenAI] = None,
+    spec_json: Optional[str] = None,
+) -> Optional[Dict]:
+    """Judge a single trial; returns its verdict or None if the output was unusable.
+
+    Verdicts are memoized per (trial context, eligibility-relevant spec fields).
+    """
+    model_name = model or _default_model()
+    key = _verdict_key(spec, nct_id, ctx, model_name)
+    cached = _verdict_cache_get(key)
+    if cached is not None:
+        return cached
+
+    messages = _judge_messages(spec, {nct_id: ctx}, spec_json=spec_json)
+    if client is None:
+        async with new_async_client() as own_client:
+            content = await _acomplete(own_client, messages, model_name)
+    else:
+        content = await _acomplete(client, messages, model_name)
+    verdict = _pick_verdict(nct_id, parse_verdicts(content))
+    if verdict is not None:
+        _verdict_cache_put(key, verdict)
+    return verdict
+
+
+async def judge_grouped_async(
+    spec: Dict,
+    grouped: Dict[str, Dict[str, List]],
+    *,
+    model: Optional[str] = None,
+    max_concurrency: int = 8,
+) -> List[Dict]:
+    """Judge each trial with its own concurrent LLM call.
+
+    Wall-clock time is roughly the slowest single call instead of the sum of
+    all calls. `max_concurrency` caps in-flight requests to respect rate limits.
+    The async client is scoped to this call because its connection pool is
+    bound to the running event loop.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    spec_json = _spec_json(spec)
+
+    async with new_async_client() as client:
+
+        async def _bounded(nct_id: str, ctx: Dict[str, List]) -> Optional[Dict]:
+            async with semaphore:
+                return await judge_one_async(
+                    spec, nct_id, ctx, model=model, client=client, spec_json=spec_json
+                )
+
+        results = await asyncio.gather(
+            *(_bounded(nct_id, ctx) for nct_id, ctx in grouped.items())
+        )
+    return [r for r in results if r is not None]
+
+
+async def ajudge_grouped(
+    spec: Dict,
+    grouped: Dict[str, Dict[str, List]],
+    *,
+    model: Optional[str] = None,
+    client: Optional[AsyncOpenAI] = None,
+) -> List[Dict]:
+    """Async counterpart of `judge_grouped`: all trials for one patient in one call."""
+    if client is None:
+        async with new_async_client() as own_client:
+            return await ajudge_grouped(spec, grouped, model=model, client=own_client)
+
+    content = await _acomplete(
+        client, _judge_messages(spec, grouped), model or _default_model()
+    )
+    return parse_verdicts(content)
 
 
 def main() -> None:
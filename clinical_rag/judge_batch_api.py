@@ -0,0 +1,179 @@
+"""Offline judging through the OpenAI Batch API (~50% cheaper, minutes-scale latency).
+
+Intended for non-interactive workloads (evals, dataset curation). Each item is
+one patient: a custom id plus its parsed spec and retrieved `grouped` trials,
+judged with the same prompt as `judge.judge_grouped`. The generic
+`submit_chat_batch` / `poll_chat_batch` helpers take arbitrary chat bodies.
+
+Usage (programmatic):
+    from clinical_rag.judge_batch_api import submit_judge_batch, wait_judge_batch
+    batch_id = submit_judge_batch(items)
+    verdicts = wait_judge_batch(batch_id, items, timeout_minutes=60)
+"""
+
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from clinical_rag._openai import get_client
+from clinical_rag.config import load_settings
+from clinical_rag.judge import judge_grouped, judge_request_body, parse_verdicts
+
+
+def _default_model() -> str:
+    return load_settings().llm_model_name
+
+
+_ENDPOINT = "/v1/chat/completions"
+_TERMINAL_FAILURES = ("failed", "expired", "cancelled", "cancelling")
+
+_LINE_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+# custom_id -> (spec, grouped)
+BatchItems = Dict[str, Tuple[Dict, Dict[str, Dict[str, List]]]]
+
+
+def _batch_request_line(custom_id: str, body: Dict) -> str:
+    return _LINE_ENCODER.encode(
+        {"custom_id": custom_id, "method": "POST", "url": _ENDPOINT, "body": body}
+    )
+
+
+def submit_chat_batch(
+    bodies: Dict[str, Dict],
+    *,
+    client: Optional[OpenAI] = None,
+    filename: str = "chat_batch.jsonl",
+) -> str:
+    """Upload one chat-completions body per custom_id and start a 24h batch.
+
+    Returns the batch id. Shared by the judge helpers below and offline
+    dataset builders (e.g. eval.generate_gold --batch).
+    """
+    client = client or get_client()
+    lines = [_batch_request_line(custom_id, body) for custom_id, body in bodies.items()]
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
+    upload = client.files.create(file=(filename, payload), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=upload.id,
+        endpoint=_ENDPOINT,
+        completion_window="24h",
+    )
+    return batch.id
+
+
+def poll_chat_batch(
+    batch_id: str, *, client: Optional[OpenAI] = None
+) -> Optional[Dict[str, str]]:
+    """Return message content keyed by custom_id once the batch completes, else None.
+
+    Raises RuntimeError if the batch failed, expired, or was cancelled. Items
+    whose individual request errored are absent from the result.
+    """
+    client = client or get_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status in _TERMINAL_FAILURES:
+        raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+    if batch.status != "completed":
+        return None
+
+    results: Dict[str, str] = {}
+    if not batch.output_file_id:
+        return results
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        choices = (response.get("body") or {}).get("choices") or []
+        if not choices:
+            continue
+        results[record.get("custom_id")] = (
+            choices[0].get("message") or {}
+        ).get("content") or ""
+    return results
+
+
+def submit_judge_batch(
+    items: BatchItems,
+    *,
+    model: Optional[str] = None,
+    client: Optional[OpenAI] = None,
+) -> str:
+    """Upload one chat request per item and start a 24h batch; returns the batch id."""
+    model_name = model or _default_model()
+    bodies = {
+        custom_id: judge_request_body(spec, grouped, model_name)
+        for custom_id, (spec, grouped) in items.items()
+        if grouped
+    }
+    return submit_chat_batch(bodies, client=client, filename="judge_batch.jsonl")
+
+
+def poll_judge_batch(
+    batch_id: str, *, client: Optional[OpenAI] = None
+) -> Optional[Dict[str, List[Dict]]]:
+    """Return verdicts keyed by custom_id once the batch completes, else None.
+
+    Raises RuntimeError if the batch failed, expired, or was cancelled. Items
+    whose individual request errored are absent from the result.
+    """
+    contents = poll_chat_batch(batch_id, client=client)
+    if contents is None:
+        return None
+    return {
+        custom_id: parse_verdicts(content or "{}")
+        for custom_id, content in contents.items()
+    }
+
+
+def wait_judge_batch(
+    batch_id: str,
+    items: BatchItems,
+    *,
+    timeout_minutes: float = 60.0,
+    poll_interval: float = 30.0,
+    model: Optional[str] = None,
+    client: Optional[OpenAI] = None,
+) -> Dict[str, List[Dict]]:
+    """Poll until the batch finishes, falling back to synchronous judging.
+
+    If the batch has not completed within `timeout_minutes` (or ends in a
+    failure state) it is cancelled and every item is judged via
+    `judge_grouped`. Items missing from a completed batch are judged the same way.
+    """
+    client = client or get_client()
+    deadline = time.monotonic() + timeout_minutes * 60
+    results: Optional[Dict[str, List[Dict]]] = None
+    while True:
+        try:
+            results = poll_judge_batch(batch_id, client=client)
+        except RuntimeError as exc:
+            print(f"[judge_batch_api] {exc}; falling back to synchronous judging")
+            break
+        if results is not None:
+            break
+        if time.monotonic() >= deadline:
+            print(
+                f"[judge_batch_api] Batch {batch_id} not done after "
+                f"{timeout_minutes:g} min; cancelling and judging synchronously"
+            )
+            try:
+                client.batches.cancel(batch_id)
+            except Exception:
+                pass
+            break
+        time.sleep(poll_interval)
+
+    results = dict(results or {})
+    for custom_id, (spec, grouped) in items.items():
+        if custom_id in results:
+            continue
+        results[custom_id] = (
+            judge_grouped(spec, grouped, model=model) if grouped else []
+        )
+    return results
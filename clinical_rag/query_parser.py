@@ -1,7 +1,9 @@
-"""Query Rewrite and Parsing Module (LLM-only).
+"""Query Rewrite and Parsing Module.
 
 Uses OpenAI Chat Completions with an externalized system prompt to parse
-patient descriptions into a normalized JSON spec.
+patient descriptions into a normalized JSON spec. Blank input, input that is
+already a JSON spec, and intakes that follow a fixed clause template are
+handled locally without an LLM call.
 
 Usage (programmatic):
     from clinical_rag.query_parser import parse
@@ -12,19 +14,28 @@ CLI (ad-hoc):
 """
 
 from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Optional, Union, List
 import argparse
 import json
-import os
+import re
+import sys
 
-from pydantic import BaseModel, Field
 from openai import OpenAI
+from pydantic import BaseModel, Field
 
+from clinical_rag._openai import get_client
+from clinical_rag.jsonutil import JsonEndTracker, parse_json_object
 from clinical_rag.prompts.query_parser_prompt import SYSTEM_PROMPT
 from clinical_rag.config import load_settings
 
 
-_SETTINGS = load_settings()
+def _default_model() -> str:
+    return load_settings().llm_model_name
+
+
+def _stream_enabled() -> bool:
+    return load_settings().query_parser_stream
 
 
 class QuerySpec(BaseModel):
@@ -36,68 +47,284 @@ class QuerySpec(BaseModel):
         return self.model_dump()
 
 
-def parse(text: str, *, llm_model: Optional[str] = None) -> Dict:
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is required for LLM parsing")
+_LIST_KEYS = ("conditions", "medications", "extra_terms")
+_DEMOGRAPHIC_KEYS = ("age", "sex", "location")
+# (spec field, prefix) in query order; shared by the component and flat builders
+_COMPONENT_FORMATS = (
+    ("conditions", "conditions:"),
+    ("medications", "meds:"),
+    ("extra_terms", "context:"),
+)
+_join_items = ", ".join
+
+# Template fast path: intakes written as "<N>-year-old <sex> with <conditions>;
+# taking <meds>; prefers <terms>; in <place>." are parsed without an LLM call.
+# Items are split on commas only. Every clause must match; anything else falls
+# back to the LLM, as does any item that is not lowercase (it may need the
+# model's canonicalization), is negated or non-clinical ("no cancer", "a
+# waitlist"), or contains a conjunction or history marker, since "head and neck
+# cancer" or "history of smoking" cannot be split or taken literally.
+_RE_CLAUSE_SPLIT = re.compile(r"\s*;\s*")
+_RE_HEAD = re.compile(
+    r"(?:an? )?\d{1,3}[- ]year[- ]old(?: (?:male|female|man|woman))?"
+    r" with (?P<items>.+)",
+    re.IGNORECASE,
+)
+_RE_CLAUSES = (
+    ("medications", re.compile(r"(?:currently )?taking (?P<items>.+)")),
+    ("conditions", re.compile(r"comorbidities include (?P<items>.+)")),
+    ("extra_terms", re.compile(r"prefers (?P<items>.+)")),
+    (None, re.compile(r"(?:lives |located |based )?in [A-Z].*")),
+)
+_RE_ITEM_SPLIT = re.compile(r"\s*,\s*")
+_MAX_ITEM_WORDS = {"conditions": 5, "medications": 3, "extra_terms": 3}
+# Leading words that negate an item or mark it as a non-term phrase
+_NON_TERM_LEADS = frozenset(
+    {"no", "not", "none", "denies", "without", "a", "an", "the"}
+)
+# Words anywhere in an item that make a literal comma split unsafe
+_AMBIGUOUS_WORDS = frozenset({"and", "or", "history"})
+
+# Built once and shared by every request; neither we nor the SDK mutate it
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+# JSON mode: the model must return one JSON object
+_RESPONSE_FORMAT = {"type": "json_object"}
+# Routes parser calls to the same server-side prompt cache (stable system prefix)
+_PROMPT_CACHE_KEY = "trialgpt-query-parser"
+# Intakes are short; cap pasted notes so one outlier can't dominate token spend
+_MAX_INPUT_CHARS = 2048
+
+
+def _coerce_json(raw: str) -> Dict:
+    if not raw.strip():
+        return {}
+    data = parse_json_object(raw)
+    if data is None:
+        raise ValueError(
+            "Query parser returned non-JSON content. Received: " + raw.strip()
+        )
+    return data
+
+
+def _normalize(text: str) -> str:
+    # Collapse whitespace so trivially different inputs share a cache entry.
+    # Truncation to _MAX_INPUT_CHARS happens only when building LLM messages,
+    # so a long pre-structured JSON spec still reaches `_local_parse` intact.
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=10_000)
+def _canon_term(value: str) -> str:
+    # Terms like "metastatic breast cancer" recur across specs: strip each
+    # distinct value once and intern it so every spec shares one string. Case
+    # is kept, since the parser prompt preserves proper nouns.
+    return sys.intern(value.strip())
+
+
+def _to_spec(data: Dict, *, keep_demographics: bool = False) -> Dict:
+    """Validated spec from `data`; age/sex/location are None unless kept.
+
+    The LLM is told not to fill demographics, so its output never supplies
+    them; specs fed back in pre-structured keep theirs.
+    """
+    fields = dict(data)
+    for key in _LIST_KEYS:
+        if fields.get(key) is None:
+            fields[key] = []
+    return _finish_spec(
+        QuerySpec(**fields).to_dict(), data if keep_demographics else None
+    )
+
+
+def _finish_spec(spec: Dict, demographics: Optional[Dict] = None) -> Dict:
+    for key in _LIST_KEYS:
+        spec[key] = [_canon_term(value) for value in spec[key]]
+    source = demographics or {}
+    return {**spec, **{key: source.get(key) for key in _DEMOGRAPHIC_KEYS}}
+
+
+def _spec_from_content(content: str) -> Dict:
+    """Spec from raw parser output, decoded and validated in one pydantic pass.
+
+    Nulls, fences or stray prose fail the one-pass validation and take the
+    lenient `_coerce_json` path instead.
+    """
+    try:
+        spec = QuerySpec.model_validate_json(content).to_dict()
+    except ValueError:  # pydantic's ValidationError included
+        return _to_spec(_coerce_json(content))
+    return _finish_spec(spec)
+
+
+def _split_items(group: str, key: str) -> Optional[List[str]]:
+    items = list(dict.fromkeys(i for i in _RE_ITEM_SPLIT.split(group) if i))
+    limit = _MAX_ITEM_WORDS[key]
+    for item in items:
+        words = item.split()
+        if (
+            item != item.lower()
+            or len(words) > limit
+            or words[0] in _NON_TERM_LEADS
+            or not _AMBIGUOUS_WORDS.isdisjoint(words)
+        ):
+            return None
+    return items or None
 
-    client = OpenAI()
-    model_to_use = llm_model or _SETTINGS.llm_model_name
+
+def _template_parse(text: str) -> Optional[Dict]:
+    """Parse a normalized intake that fits the clause template, else None."""
+    clauses = _RE_CLAUSE_SPLIT.split(text.rstrip(". "))
+    head = _RE_HEAD.fullmatch(clauses[0])
+    if head is None:
+        return None
+    data: Dict[str, List[str]] = {key: [] for key in _LIST_KEYS}
+    pending = [("conditions", head["items"])]
+    for clause in clauses[1:]:
+        for key, pattern in _RE_CLAUSES:
+            match = pattern.fullmatch(clause)
+            if match:
+                break
+        else:
+            return None
+        if key is not None:
+            pending.append((key, match["items"]))
+    for key, group in pending:
+        items = _split_items(group, key)
+        if items is None:
+            return None
+        data[key] = list(dict.fromkeys(data[key] + items))
+    return data
+
+
+def _local_parse(text: str) -> Optional[Dict]:
+    """Spec data for normalized `text` when no LLM call is needed, else None.
+
+    Blank input yields empty lists; input that already is a JSON spec (e.g. a
+    cached spec fed back through a pipeline) is used as-is when it validates,
+    including its age/sex/location; template-shaped intakes go through
+    `_template_parse`. Convert results with `_to_spec(..., keep_demographics=True)`.
+    """
+    if not text:
+        return {key: [] for key in _LIST_KEYS}
+    if text[0] == "{" and text[-1] == "}":
+        data = parse_json_object(text)
+        if data is not None and any(key in data for key in _LIST_KEYS):
+            try:
+                _to_spec(data)
+            except ValueError:  # pydantic's ValidationError included
+                return None
+            return data
+        return None
+    return _template_parse(text)
+
+
+def _single_messages(text: str) -> List[Dict[str, str]]:
+    return [
+        _SYSTEM_MESSAGE,
+        {"role": "user", "content": text[:_MAX_INPUT_CHARS]},
+    ]
+
+
+def _parse_streaming(text: str, model: str, client: OpenAI) -> str:
+    """Stream the parser completion, returning once the top-level JSON object closes."""
+    stream = client.chat.completions.create(
+        model=model,
+        messages=_single_messages(text),
+        temperature=0,
+        prompt_cache_key=_PROMPT_CACHE_KEY,
+        response_format=_RESPONSE_FORMAT,
+        stream=True,
+    )
+    parts: List[str] = []
+    tracker = JsonEndTracker()
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                end = tracker.feed(delta)
+                if end >= 0:
+                    parts.append(delta[:end])
+                    break
+                parts.append(delta)
+    finally:
+        stream.close()
+    return "".join(parts) or "{}"
+
+
+def _complete_parse(text: str, model: str, client: OpenAI) -> str:
+    """Raw parser LLM output for normalized `text` (one API call)."""
+    if _stream_enabled():
+        return _parse_streaming(text, model, client)
     resp = client.chat.completions.create(
-        model=model_to_use,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": text},
-        ],
+        model=model,
+        messages=_single_messages(text),
         temperature=0,
+        prompt_cache_key=_PROMPT_CACHE_KEY,
+        response_format=_RESPONSE_FORMAT,
     )
-    content = resp.choices[0].message.content or "{}"
-
-    def _coerce_json(raw: str) -> Dict:
-        stripped = raw.strip()
-        if not stripped:
-            return {}
-        try:
-            return json.loads(stripped)
-        except json.JSONDecodeError:
-            start = stripped.find("{")
-            end = stripped.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                try:
-                    return json.loads(stripped[start : end + 1])
-                except json.JSONDecodeError:
-                    pass
-            raise ValueError(
-                "Query parser returned non-JSON content. Received: " + stripped
-            )
-
-    data = _coerce_json(content)
-    for key in ("conditions", "medications", "extra_terms"):
-        value = data.get(key)
-        if value is None:
-            data[key] = []
-    spec = QuerySpec(**data).to_dict()
-    return {**spec, "age": None, "sex": None, "location": None}
+    return resp.choices[0].message.content or "{}"
+
+
+@lru_cache(maxsize=1024)
+def _parse_cached(text: str, model: str) -> str:
+    """`_complete_parse` on the shared client; temperature=0 makes it repeatable.
+
+    Returns the immutable content string so every caller builds a fresh dict.
+    Only the shared client is cached: keying on injected clients would keep
+    each one (and its connection pool) alive until evicted.
+    """
+    return _complete_parse(text, model, get_client())
+
+
+def parse(
+    text: str, *, llm_model: Optional[str] = None, client: Optional[OpenAI] = None
+) -> Dict:
+    """Parse free text into a spec; `client` defaults to the shared process client.
+
+    LLM output is memoized per normalized text for the shared client only.
+    """
+    normalized = _normalize(text)
+    data = _local_parse(normalized)
+    if data is not None:
+        return _to_spec(data, keep_demographics=True)
+    model_to_use = llm_model or _default_model()
+    if client is None:
+        content = _parse_cached(normalized, model_to_use)
+    else:
+        content = _complete_parse(normalized, model_to_use, client)
+    return _spec_from_content(content)
+
+
+def _spec_lists(spec: Union[Dict, QuerySpec]) -> Dict:
+    # Specs from `parse` were validated when built; read dicts as-is instead of
+    # re-running pydantic on every query build
+    return spec.__dict__ if isinstance(spec, QuerySpec) else spec
 
 
 def build_query_components(spec: Union[Dict, QuerySpec]) -> "OrderedDict[str, str]":
     """Return ordered mapping of semantic query components."""
-    if not isinstance(spec, QuerySpec):
-        spec = QuerySpec(**spec)
-
+    fields = _spec_lists(spec)
     parts: "OrderedDict[str, str]" = OrderedDict()
-    if spec.conditions:
-        parts["conditions"] = "conditions:" + ", ".join(spec.conditions)
-    if spec.medications:
-        parts["medications"] = "meds:" + ", ".join(spec.medications)
-    if spec.extra_terms:
-        parts["extra_terms"] = "context:" + ", ".join(spec.extra_terms)
+    for key, prefix in _COMPONENT_FORMATS:
+        values = fields.get(key)
+        if values:
+            parts[key] = prefix + _join_items(values)
     return parts
 
 
 def build_query_text(spec: Union[Dict, QuerySpec]) -> str:
     """Construct a deterministic semantic query string from a parsed spec."""
-    components = build_query_components(spec)
-    return " ".join(components.values())
+    fields = _spec_lists(spec)
+    # A list comprehension, not a generator: str.join materializes it anyway
+    return " ".join(
+        [
+            prefix + _join_items(values)
+            for key, prefix in _COMPONENT_FORMATS
+            if (values := fields.get(key))
+        ]
+    )
 
 
 def main() -> None:
@@ -110,7 +337,7 @@ def main() -> None:
     parser.add_argument(
         "--model",
         type=str,
-        default=_SETTINGS.llm_model_name,
+        default=_default_model(),
         help="OpenAI chat model id (defaults to LLM_MODEL_NAME or project default)",
     )
     args = parser.parse_args()
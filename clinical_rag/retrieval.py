@@ -7,10 +7,13 @@ Returns inclusion/exclusion bullets from the trial payload in a format
 compatible with the judge and app layers.
 """
 
-from collections import defaultdict
+from collections import ChainMap, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Dict, List, Optional, Tuple
+import sys
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as http_models
 from fastembed import TextEmbedding
@@ -21,31 +24,76 @@ from typing import OrderedDict as _OrderedDict
 from clinical_rag.query_parser import build_query_components, build_query_text
 
 
-_SETTINGS = load_settings()
-
-
 @lru_cache(maxsize=1)
 def _get_client() -> QdrantClient:
-    return QdrantClient(url=_SETTINGS.qdrant_url)
+    settings = load_settings()
+    # gRPC: protobuf responses decode faster than JSON for payload-heavy hits
+    return QdrantClient(
+        url=settings.qdrant_url,
+        grpc_port=settings.qdrant_grpc_port,
+        prefer_grpc=True,
+    )
 
 
-@lru_cache(maxsize=1)
-def _get_embedder() -> TextEmbedding:
-    return TextEmbedding(model_name=_SETTINGS.embedding_model_name)
+# ONNX Runtime providers per device; "cuda" needs onnxruntime-gpu installed
+# and falls back to the CPU provider for unsupported ops
+_EMBED_PROVIDERS = {
+    "cpu": ["CPUExecutionProvider"],
+    "cuda": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+}
 
 
-def build_filters(
+@lru_cache(maxsize=len(_EMBED_PROVIDERS))
+def _get_embedder(device: str = "cpu") -> TextEmbedding:
+    # FastEmbed's bge-small-en-v1.5 is already the quantized ONNX export
+    # (Qdrant/bge-small-en-v1.5-onnx-Q); pin the provider and thread count
+    settings = load_settings()
+    embedder = TextEmbedding(
+        model_name=settings.embedding_model_name,
+        threads=settings.embedding_threads,
+        providers=_EMBED_PROVIDERS[device],
+    )
+    # Warm up the ONNX session so the first real query doesn't pay for it
+    list(embedder.embed([" "]))
+    return embedder
+
+
+def _embed(texts: List[str], *, device: str = "cpu") -> np.ndarray:
+    """Embed texts in one call; returns a (len(texts), dim) float32 matrix."""
+    vectors = _get_embedder(device).embed(texts)
+    return np.stack(list(vectors)).astype(np.float32, copy=False)
+
+
+def _filter_key(
     spec: Dict,
-    *,
-    recruiting_only: bool = True,
+) -> Tuple[str, Optional[int], Optional[str], Optional[str], Optional[str]]:
+    """Reduce a spec to the normalized fields that shape the Qdrant filter."""
+    sex = (spec.get("sex") or "").upper()
+    age = spec.get("age")
+    loc = spec.get("location") or {}
+    if not isinstance(loc, dict):
+        loc = {}
+    return (
+        sex if sex in ("MALE", "FEMALE") else "",
+        age if isinstance(age, int) else None,
+        (loc.get("city") or "").strip().lower() or None,
+        (loc.get("state") or "").strip().lower() or None,
+        (loc.get("country") or "").strip().lower() or None,
+    )
+
+
+@lru_cache(maxsize=512)
+def _build_filters_cached(
+    key: Tuple[str, Optional[int], Optional[str], Optional[str], Optional[str]],
 ) -> Optional[http_models.Filter]:
-    must: List[http_models.FieldCondition] = []
+    # The returned Filter is shared between callers; treat it as read-only
+    sex, age, city, state, country = key
+    must: List[Union[http_models.FieldCondition, http_models.Filter]] = []
 
     # Recruiting status: handled upstream during ingest; no filter here to avoid redundancy
 
     # Gender compatibility: if patient sex present, allow trials with same sex or ALL
-    sex = (spec.get("sex") or "").upper()
-    if sex in ("MALE", "FEMALE"):
+    if sex:
         must.append(
             http_models.FieldCondition(
                 key="gender",
@@ -53,69 +101,98 @@ def build_filters(
             )
         )
 
-    # Age bounds: ensure trial min_age <= patient age (skip max_age to avoid excluding trials with null max)
-    age = spec.get("age")
-    if isinstance(age, int):
+    # Age bounds: trial min_age <= patient age, and max_age >= age unless max_age is unset
+    if age is not None:
         must.append(
             http_models.FieldCondition(
                 key="min_age",
                 range=http_models.Range(lte=age),
             )
         )
-        # Optional: enforce max_age >= age if present in payload; omitted here to avoid excluding nulls
+        must.append(
+            http_models.Filter(
+                should=[
+                    http_models.FieldCondition(
+                        key="max_age",
+                        range=http_models.Range(gte=age),
+                    ),
+                    http_models.IsEmptyCondition(
+                        is_empty=http_models.PayloadField(key="max_age")
+                    ),
+                ]
+            )
+        )
 
     # Location facets
-    loc = spec.get("location") or {}
-    if isinstance(loc, dict):
-        city = (loc.get("city") or "").strip().lower() or None
-        state = (loc.get("state") or "").strip().lower() or None
-        country = (loc.get("country") or "").strip().lower() or None
-        if city:
-            must.append(
-                http_models.FieldCondition(
-                    key="location_cities",
-                    match=http_models.MatchValue(value=city),
-                )
+    if city:
+        must.append(
+            http_models.FieldCondition(
+                key="location_cities",
+                match=http_models.MatchValue(value=city),
             )
-        if state:
-            must.append(
-                http_models.FieldCondition(
-                    key="location_states",
-                    match=http_models.MatchValue(value=state),
-                )
+        )
+    if state:
+        must.append(
+            http_models.FieldCondition(
+                key="location_states",
+                match=http_models.MatchValue(value=state),
             )
-        if country:
-            must.append(
-                http_models.FieldCondition(
-                    key="location_countries",
-                    match=http_models.MatchValue(value=country),
-                )
+        )
+    if country:
+        must.append(
+            http_models.FieldCondition(
+                key="location_countries",
+                match=http_models.MatchValue(value=country),
             )
+        )
 
     if not must:
         return None
     return http_models.Filter(must=must)
 
 
-def _postfilter_by_max_age(spec: Dict, hits: List) -> List:
-    """Filter out hits where patient's age exceeds trial max_age when max_age is set."""
-    age = spec.get("age")
-    if not isinstance(age, int):
-        return hits
-    kept: List = []
-    for h in hits:
-        p = h.payload or {}
-        max_age = p.get("max_age")
-        if max_age is None or (isinstance(max_age, int) and age <= max_age):
-            kept.append(h)
-    return kept
+def build_filters(
+    spec: Dict,
+    *,
+    recruiting_only: bool = True,
+) -> Optional[http_models.Filter]:
+    return _build_filters_cached(_filter_key(spec))
 
 
 class _PayloadWrapper:
-    """Lightweight object to mimic Qdrant hit interface used downstream (has .payload)."""
+    """Lightweight object to mimic Qdrant hit interface used downstream (has .payload).
+
+    The payload layers the per-bullet fields over the trial's shared `common`
+    dict (a ChainMap), so bullets reference it instead of copying it.
+    """
+
+    __slots__ = ("payload",)
 
-    def __init__(self, payload: Dict):
-        self.payload = payload
+    def __init__(self, common: Dict, chunk_id: str, text: Optional[str]):
+        self.payload = ChainMap({"chunk_id": chunk_id, "text": text}, common)
+
+
+def _truncate_dim(vector: np.ndarray, dim: Optional[int] = None) -> np.ndarray:
+    """Matryoshka-truncate to `dim` dims and L2-renormalize.
+
+    `dim` defaults to the `embedding_dim_truncate` setting.
+    """
+    if dim is None:
+        dim = load_settings().embedding_dim_truncate
+    if not dim or dim >= vector.shape[-1]:
+        return vector
+    vector = vector[..., :dim]
+    norm = np.linalg.norm(vector, axis=-1, keepdims=True)
+    return vector / np.where(norm > 0, norm, 1.0)
+
+
+def embed_passages(texts: List[str], *, device: str = "cpu") -> np.ndarray:
+    """Embed trial texts for storage with the query-time model and truncation.
+
+    Returns a (len(texts), dim) float32 matrix; used by ingest so stored vectors
+    always match the query vectors they are searched with.
+    """
+    return _truncate_dim(_embed(texts, device=device))
 
 
 _COMPONENT_WEIGHTS = {
@@ -126,7 +203,39 @@ _COMPONENT_WEIGHTS = {
 }
 
 
-def _weighted_query_vector(spec: Dict) -> List[float]:
+@lru_cache(maxsize=1024)
+def _weighted_query_vector_cached(
+    items: Tuple[Tuple[str, str, float], ...],
+    fallback_text: str,
+    dim: Optional[int],
+) -> np.ndarray:
+    """Embed and combine (name, text, weight) components; read-only result.
+
+    Embedding is deterministic and independent of filters, so repeated or
+    filter-only-tweaked searches reuse the vector. `dim` is the truncation
+    setting, part of the key so a changed setting never serves old-size vectors.
+    """
+    total_weight = sum(weight for _, _, weight in items)
+    if not items or total_weight <= 0:
+        # Fallback to a single embedding of whatever query text is available
+        vector = _embed([fallback_text or " "])[0]
+    elif len(items) == 1:
+        # A lone component has normalized weight 1.0; nothing to combine
+        vector = _embed([items[0][1]])[0]
+    else:
+        # (k, dim) matrix of component embeddings; one SGEMV combines them in a
+        # single fused multiply-add pass instead of k scale + k-1 add passes
+        vectors = _embed([text for _, text, _ in items])
+        weights = np.asarray(
+            [weight / total_weight for _, _, weight in items], dtype=np.float32
+        )
+        vector = weights @ vectors
+    vector = _truncate_dim(vector, dim)
+    vector.setflags(write=False)
+    return vector
+
+
+def _weighted_query_vector(spec: Dict) -> np.ndarray:
     components: _OrderedDict[str, str] = build_query_components(spec)
     items: List[tuple[str, str, float]] = []
     for name, text in components.items():
@@ -134,88 +243,85 @@ def _weighted_query_vector(spec: Dict) -> List[float]:
         if not text or weight <= 0:
             continue
         items.append((name, text, weight))
+    fallback_text = "" if items else build_query_text(spec)
+    return _weighted_query_vector_cached(
+        tuple(items), fallback_text, load_settings().embedding_dim_truncate
+    )
 
-    if not items:
-        # Fallback to a single embedding of whatever query text is available
-        qtext = build_query_text(spec) or " "
-        embedder = _get_embedder()
-        return list(embedder.embed([qtext]))[0]
-
-    total_weight = sum(weight for _, _, weight in items)
-    if total_weight <= 0:
-        qtext = build_query_text(spec) or " "
-        embedder = _get_embedder()
-        return list(embedder.embed([qtext]))[0]
 
-    embedder = _get_embedder()
-    texts = [text for _, text, _ in items]
-    raw_vectors = list(embedder.embed(texts))
-    norm_weights = [weight / total_weight for _, _, weight in items]
+def _query_vector(spec: Dict, *, weighted: bool = True) -> np.ndarray:
+    """Weighted per-component embedding, or one embedding of the flat query text."""
+    if weighted:
+        return _weighted_query_vector(spec)
+    return _weighted_query_vector_cached(
+        (), build_query_text(spec), load_settings().embedding_dim_truncate
+    )
 
-    weighted_vector: List[float] | None = None
-    for vec, norm_weight in zip(raw_vectors, norm_weights):
-        scaled = [norm_weight * v for v in vec]
-        if weighted_vector is None:
-            weighted_vector = scaled
-        else:
-            weighted_vector = [a + b for a, b in zip(weighted_vector, scaled)]
 
-    # weighted_vector cannot be None because items is non-empty
-    return weighted_vector or []
+@lru_cache(maxsize=65536)
+def _norm(value: Optional[str]) -> str:
+    # Facet strings repeat across thousands of trials: memoize and intern
+    return sys.intern(value.strip().lower()) if value else ""
 
 
 @lru_cache(maxsize=1)
-def get_location_facets(limit_per_scroll: int = 256) -> Dict[str, object]:
+def get_location_facets(limit_per_scroll: int = 4096) -> Dict[str, object]:
     """Return unique location options from Qdrant payloads.
 
     Results include sorted lists of countries, states keyed by country, and cities keyed by (country, state).
     """
 
     client = _get_client()
-    collection = _SETTINGS.collection_name
+    collection = load_settings().collection_name
 
-    countries: set[str] = set()
-    states_by_country: Dict[str, set[str]] = defaultdict(set)
-    cities_by_region: Dict[Tuple[str, str], set[str]] = defaultdict(set)
+    # Collect normalized (country, state, city) once; derive the nested views after
+    triples: set[Tuple[str, str, str]] = set()
 
-    next_offset = None
-    while True:
-        scroll_result = client.scroll(
+    def fetch(offset):
+        return client.scroll(
             collection_name=collection,
             limit=limit_per_scroll,
-            offset=next_offset,
-            with_payload=True,
+            offset=offset,
+            # Only the nested locations are needed; skip criteria text etc.
+            with_payload=http_models.PayloadSelectorInclude(include=["locations"]),
             with_vectors=False,
         )
 
-        if isinstance(scroll_result, tuple):
-            points, next_offset = scroll_result
-        else:  # pragma: no cover - compatibility path
-            points = scroll_result[0]
-            next_offset = scroll_result[1]
-
-        if not points:
-            break
-        for point in points:
-            payload = point.payload or {}
-            for loc in payload.get("locations") or []:
-                if not isinstance(loc, dict):
-                    continue
-                country = (loc.get("country") or "").strip().lower()
-                state = (loc.get("state") or "").strip().lower()
-                city = (loc.get("city") or "").strip().lower()
-                if not country and not state and not city:
-                    continue
-                if country:
-                    countries.add(country)
-                if country and state:
-                    states_by_country[country].add(state)
-                    if city:
-                        cities_by_region[(country, state)].add(city)
-                elif country and city:
-                    cities_by_region[(country, "")].add(city)
-        if next_offset is None:
-            break
+    # Prefetch the next page while the current one is walked
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(fetch, None)
+        while True:
+            points, next_offset = pending.result()
+            if points and next_offset is not None:
+                pending = pool.submit(fetch, next_offset)
+            if not points:
+                break
+            for point in points:
+                payload = point.payload or {}
+                for loc in payload.get("locations") or []:
+                    if not isinstance(loc, dict):
+                        continue
+                    country = _norm(loc.get("country"))
+                    state = _norm(loc.get("state"))
+                    city = _norm(loc.get("city"))
+                    if country or state or city:
+                        triples.add((country, state, city))
+            if next_offset is None:
+                break
+
+    countries: set[str] = set()
+    states_by_country: Dict[str, set[str]] = defaultdict(set)
+    cities_by_region: Dict[Tuple[str, str], set[str]] = defaultdict(set)
+    for country, state, city in triples:
+        if not country:
+            continue
+        countries.add(country)
+        if state:
+            states_by_country[country].add(state)
+            if city:
+                cities_by_region[(country, state)].add(city)
+        elif city:
+            cities_by_region[(country, "")].add(city)
 
     sorted_countries = sorted(countries)
     sorted_states = {
@@ -229,27 +335,50 @@ def get_location_facets(limit_per_scroll: int = 256) -> Dict[str, object]:
     }
 
 
-def _search_trials(spec: Dict, *, max_trials: int):
+# Payload keys read by _group_hits; everything else stays server-side
+_HIT_PAYLOAD = http_models.PayloadSelectorInclude(
+    include=[
+        "nct_id",
+        "trial_title",
+        "overall_status",
+        "gender",
+        "min_age",
+        "max_age",
+        "conditions",
+        "interventions",
+        "locations",
+        "location_cities",
+        "location_states",
+        "location_countries",
+        "phase",
+        "study_type",
+        "url",
+        "inclusion_criteria",
+        "exclusion_criteria",
+    ]
+)
+
+
+def _is_searchable(spec: Dict, max_trials: int) -> bool:
+    """False for degenerate requests: no trials wanted, or no query text to embed."""
+    return max_trials > 0 and bool(build_query_components(spec))
+
+
+def _search_trials(spec: Dict, *, max_trials: int, weighted: bool = True):
+    if not _is_searchable(spec, max_trials):
+        return []
     client = _get_client()
-    collection = _SETTINGS.collection_name
-    qfilter = build_filters(spec)
-    vec = _weighted_query_vector(spec)
-    hits = client.search(
-        collection_name=collection,
-        query_vector=vec,
-        query_filter=qfilter,
+    return client.query_points(
+        collection_name=load_settings().collection_name,
+        query=_query_vector(spec, weighted=weighted).tolist(),
+        query_filter=build_filters(spec),
         limit=max_trials,
-        with_payload=True,
+        with_payload=_HIT_PAYLOAD,
         with_vectors=False,
-    )
-    return _postfilter_by_max_age(spec, hits)[:max_trials]
+    ).points
 
 
-def retrieve_with_exclusions(
-    spec: Dict, *, max_trials: int = 5
-) -> Dict[str, Dict[str, List]]:
-    """Return up to max_trials, with inclusion/exclusion bullets reconstructed from trial payloads."""
-    hits = _search_trials(spec, max_trials=max_trials)
+def _group_hits(hits: List) -> Dict[str, Dict[str, List]]:
     grouped: Dict[str, Dict[str, List]] = {}
     for h in hits:
         p = h.payload or {}
@@ -276,27 +405,44 @@ def retrieve_with_exclusions(
             "url": p.get("url"),
         }
         incl_wrapped = [
-            _PayloadWrapper(
-                {**common, "chunk_id": f"{nct}:eligibility_inclusion:{i}", "text": t}
-            )
+            _PayloadWrapper(common, f"{nct}:eligibility_inclusion:{i}", t)
             for i, t in enumerate(incl)
             if t
         ]
         excl_wrapped = [
-            _PayloadWrapper(
-                {**common, "chunk_id": f"{nct}:eligibility_exclusion:{i}", "text": t}
-            )
+            _PayloadWrapper(common, f"{nct}:eligibility_exclusion:{i}", t)
             for i, t in enumerate(excl)
             if t
         ]
         if not incl_wrapped and not excl_wrapped:
-            incl_wrapped = [
-                _PayloadWrapper({**common, "chunk_id": f"{nct}:metadata", "text": None})
-            ]
-        grouped[nct] = {"info": common, "incl": incl_wrapped, "excl": excl_wrapped}
+            incl_wrapped = [_PayloadWrapper(common, f"{nct}:metadata", None)]
+        grouped[nct] = {
+            "info": common,
+            "incl": incl_wrapped,
+            "excl": excl_wrapped,
+            # Parallel id/text tuples so the judge formatter skips per-hit payload lookups
+            "incl_ids": tuple(h.payload["chunk_id"] for h in incl_wrapped),
+            "incl_texts": tuple(h.payload["text"] for h in incl_wrapped),
+            "excl_ids": tuple(h.payload["chunk_id"] for h in excl_wrapped),
+            "excl_texts": tuple(h.payload["text"] for h in excl_wrapped),
+        }
     return grouped
 
 
+def retrieve_with_exclusions(
+    spec: Dict, *, max_trials: int = 5, weighted: bool = True
+) -> Dict[str, Dict[str, List]]:
+    """Return up to max_trials, with inclusion/exclusion bullets reconstructed from trial payloads.
+
+    weighted=False embeds the flat `build_query_text(spec)` instead of the
+    weighted per-component combination. Returns {} without embedding or
+    querying when max_trials <= 0 or the spec has no query text (filters only).
+    """
+    if not _is_searchable(spec, max_trials):
+        return {}
+    return _group_hits(_search_trials(spec, max_trials=max_trials, weighted=weighted))
+
+
 def _print_grouped(
     grouped: Dict[str, Dict[str, List]], *, bullets: bool = False
 ) -> None:
@@ -336,6 +482,11 @@ def main() -> None:
         action="store_true",
         help="Print up to 5 incl/excl bullets per trial",
     )
+    parser.add_argument(
+        "--unweighted",
+        action="store_true",
+        help="Embed the flat query text instead of weighted components",
+    )
     args = parser.parse_args()
 
     # Build spec
@@ -354,7 +505,9 @@ def main() -> None:
 
         spec = llm_parse(args.text)
 
-    grouped = retrieve_with_exclusions(spec, max_trials=args.max_trials)
+    grouped = retrieve_with_exclusions(
+        spec, max_trials=args.max_trials, weighted=not args.unweighted
+    )
     _print_grouped(grouped, bullets=args.print_bullets)
 
 
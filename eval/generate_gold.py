@@ -13,6 +13,18 @@ Usage:
 
 Notes:
 - Requires OPENAI_API_KEY for both query generation and parsing.
+- Generation and parsing run as two concurrent pipeline stages
+  (--gen-concurrency / --parse-concurrency), throttled by
+  --max-requests-per-minute / --max-tokens-per-minute; rows are written in
+  completion order.
+- --batch submits all generation prompts as one OpenAI Batch API job instead
+  (roughly half the cost; minutes-to-hours latency); parsing then runs as usual.
+- Near-identical trials (same title/conditions/interventions/phase/type, sex,
+  age decade and location, e.g. sibling studies in a drug family) share one
+  generation call; their rows reuse the first trial's age and location.
+- Generated queries and their parsed specs are cached in eval/.llmcache.sqlite
+  keyed by model and prompt (parser prompt included), so reruns with the same
+  seed skip answered calls (--no-cache to bypass).
 - Each generated query is parsed via clinical_rag.query_parser.parse and
   stored under the query_spec key.
 """
@@ -20,14 +32,31 @@ Notes:
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
 import argparse
+import asyncio
+import hashlib
 import json
 import os
 import random
 import time
 
+import numpy as np
+
+from clinical_rag.prompts.query_parser_prompt import SYSTEM_PROMPT as _PARSER_PROMPT
 from clinical_rag.query_parser import parse as parse_query
+from eval.llm_cache import DEFAULT_CACHE_PATH, LLMCache, cache_key
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+    from clinical_rag._openai import AsyncRateLimiter
+
+
+# orjson isn't a project dependency; reusing one configured stdlib encoder /
+# decoder skips per-call option parsing and object setup for each JSONL row
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+_DECODER = json.JSONDecoder()
 
 
 def _find_latest_snapshot(base: Path) -> Path:
@@ -50,35 +79,85 @@ def _load_trials(path: Path) -> Iterator[Dict]:
             if not line:
                 continue
             try:
-                yield json.loads(line)
+                yield _DECODER.decode(line)
             except Exception:
                 continue
 
 
-def _choose_age(
-    min_age: Optional[int], max_age: Optional[int], *, rng: random.Random
-) -> int:
-    if isinstance(min_age, int) and isinstance(max_age, int) and max_age >= min_age:
-        if max_age == min_age:
-            return min_age
-        return rng.randint(min_age, max_age)
-    if isinstance(min_age, int):
-        return min_age + min(20, max(0, rng.randint(0, 10)))
-    if isinstance(max_age, int):
-        base = max(0, max_age - 10)
-        return rng.randint(base, max_age)
-    return 40
-
-
-def _choose_sex(trial_sex: Optional[str], *, rng: random.Random) -> Optional[str]:
-    s = (trial_sex or "").upper()
-    if s in ("MALE", "FEMALE"):
-        return s.lower()
-    if s == "ALL":
-        return rng.choice(["male", "female"])  # either is fine
+def _reservoir_sample(
+    items: Iterable[Dict], k: int, *, rng: random.Random
+) -> Tuple[List[Dict], int]:
+    """Uniformly sample up to k items in one streaming pass (Algorithm R).
+
+    Returns (sample in random order, number of items seen); memory is O(k).
+    """
+    k = max(0, k)
+    reservoir: List[Dict] = []
+    seen = 0
+    for seen, item in enumerate(items, start=1):
+        if seen <= k:
+            reservoir.append(item)
+            continue
+        j = rng.randrange(seen)
+        if j < k:
+            reservoir[j] = item
+    rng.shuffle(reservoir)
+    return reservoir, seen
+
+
+def _extract_int(t: Dict, *keys: str) -> Optional[int]:
+    for key in keys:
+        value = t.get(key)
+        if value is not None:
+            return value if isinstance(value, int) else None
     return None
 
 
+def _choose_ages_and_sexes(
+    sample: List[Dict], *, rng: np.random.Generator
+) -> Tuple[List[int], List[Optional[str]]]:
+    """Draw an example age and sex for every sampled trial in one vectorized pass.
+
+    Ages are uniform over the trial's [min, max] range; with only a minimum
+    they fall in [min, min + 10], with only a maximum in [max - 10, max]
+    (floored at 0), and default to 40. Sex follows the trial's restriction;
+    trials open to ALL get a coin flip, unknown values get None.
+    """
+    n = len(sample)
+    mins = np.full(n, -1, dtype=np.int64)
+    maxs = np.full(n, -1, dtype=np.int64)
+    sexes = np.empty(n, dtype=object)
+    for i, t in enumerate(sample):
+        min_age = _extract_int(t, "min_age_years", "min_age")
+        max_age = _extract_int(t, "max_age_years", "max_age")
+        if min_age is not None:
+            mins[i] = min_age
+        if max_age is not None:
+            maxs[i] = max_age
+        sexes[i] = (t.get("sex") or t.get("gender") or "").upper()
+
+    has_min = mins >= 0
+    has_max = maxs >= 0
+    both = has_min & has_max & (maxs >= mins)
+    only_min = has_min & ~both
+    only_max = ~has_min & has_max
+
+    lo = np.full(n, 40, dtype=np.int64)
+    hi = np.full(n, 40, dtype=np.int64)
+    lo[both], hi[both] = mins[both], maxs[both]
+    lo[only_min], hi[only_min] = mins[only_min], mins[only_min] + 10
+    lo[only_max], hi[only_max] = np.maximum(0, maxs[only_max] - 10), maxs[only_max]
+    ages = rng.integers(lo, hi + 1)
+
+    coin = np.where(rng.integers(0, 2, size=n) == 0, "male", "female")
+    sex_words = np.full(n, None, dtype=object)
+    sex_words[sexes == "MALE"] = "male"
+    sex_words[sexes == "FEMALE"] = "female"
+    is_all = sexes == "ALL"
+    sex_words[is_all] = coin[is_all]
+    return ages.tolist(), sex_words.tolist()
+
+
 def _choose_location(
     locs: List[Dict], *, rng: random.Random
 ) -> Dict[str, Optional[str]]:
@@ -92,6 +171,18 @@ def _choose_location(
     }
 
 
+# Fully static so every request shares the same prefix for provider-side
+# prompt caching; all per-trial details go in the user message
+_SYSTEM_PROMPT = (
+    "You are generating concise patient descriptions to evaluate a clinical trials retrieval system.\n"
+    "Return ONE short, natural English sentence (no bullets) describing a hypothetical patient whose case\n"
+    "should retrieve the target trial. Include key signals (age, sex if applicable, primary condition(s),\n"
+    "notable intervention(s)/drug/device terms, and a location token). Do NOT mention NCT IDs or quote\n"
+    "the exact trial title; paraphrase naturally."
+)
+_PROMPT_CACHE_KEY = "trialgpt-gold"
+
+
 def _build_llm_prompt(
     trial: Dict, age: int, sex_word: Optional[str], loc: Dict[str, Optional[str]]
 ) -> Tuple[str, str]:
@@ -105,13 +196,6 @@ def _build_llm_prompt(
     state = (loc.get("state") or "").strip()
     country = (loc.get("country") or "").strip()
 
-    sys = (
-        "You are generating concise patient descriptions to evaluate a clinical trials retrieval system.\n"
-        "Return ONE short, natural English sentence (no bullets) describing a hypothetical patient whose case\n"
-        "should retrieve the target trial. Include key signals (age, sex if applicable, primary condition(s),\n"
-        "notable intervention(s)/drug/device terms, and a location token). Do NOT mention NCT IDs or quote\n"
-        "the exact trial title; paraphrase naturally."
-    )
     user = (
         "Target trial summary:\n"
         f"- Title: {title}\n"
@@ -124,7 +208,7 @@ def _build_llm_prompt(
         f"- Location example tokens: {[t for t in [city, state, country] if t]}\n\n"
         "Write the single-sentence patient description now."
     )
-    return sys, user
+    return _SYSTEM_PROMPT, user
 
 
 def _synth_query(
@@ -149,6 +233,451 @@ def _synth_query(
     return " ".join(parts)
 
 
+# Completion allowance for the one-sentence reply when throttling on TPM
+_REPLY_TOKENS = 80
+
+
+def _estimate_tokens(system: str, user: str) -> int:
+    # ~4 chars/token for the prompt
+    return (len(system) + len(user)) // 4 + _REPLY_TOKENS
+
+
+Plan = Tuple[Dict, int, Optional[str], Dict[str, Optional[str]]]
+
+
+def _dedup_key(plan: Plan) -> bytes:
+    """Hash of the prompt-relevant trial fields; equal keys share one LLM call."""
+    t, age, sex_word, loc = plan
+    fields = [
+        (t.get("trial_title") or "").strip(),
+        t.get("conditions") or [],
+        t.get("interventions") or [],
+        t.get("phase") or "",
+        t.get("study_type") or "",
+        sex_word,
+        age // 10,
+        [(loc.get(k) or "").strip() for k in ("city", "state", "country")],
+    ]
+    return hashlib.blake2b(
+        _ENCODER.encode(fields).encode("utf-8"), digest_size=16
+    ).digest()
+
+
+def _dedup_plans(plans: List[Plan]) -> Tuple[List[Plan], int]:
+    """Give plans with the same dedup key the first one's age.
+
+    Their prompts then match exactly, so one generated query serves all of
+    them and each row still records the guidance it was written for. Returns
+    (plans, number of duplicates).
+    """
+    leaders: Dict[bytes, int] = {}
+    out: List[Plan] = []
+    for t, age, sex_word, loc in plans:
+        age = leaders.setdefault(_dedup_key((t, age, sex_word, loc)), age)
+        out.append((t, age, sex_word, loc))
+    return out, len(plans) - len(leaders)
+
+
+def _generation_body(plan: Plan, model: str) -> Dict:
+    t, age, sex_word, loc = plan
+    sys, user = _build_llm_prompt(t, age, sex_word, loc)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": sys},
+            {"role": "user", "content": user},
+        ],
+        "temperature": 0.2,
+        "prompt_cache_key": _PROMPT_CACHE_KEY,
+    }
+
+
+def _generation_cache_key(body: Dict) -> str:
+    return cache_key("gold", body["model"], *(m["content"] for m in body["messages"]))
+
+
+async def _generate_query(
+    client: "AsyncOpenAI",
+    plan: Plan,
+    *,
+    model: str,
+    rpm: "AsyncRateLimiter",
+    tpm: "AsyncRateLimiter",
+    cache: Optional[LLMCache] = None,
+) -> str:
+    # Build query via LLM with synth fallback on error
+    body = _generation_body(plan, model)
+    key = _generation_cache_key(body) if cache else ""
+    if cache and (cached := cache.get(key)) is not None:
+        return cached
+    await rpm.acquire()
+    await tpm.acquire(_estimate_tokens(*(m["content"] for m in body["messages"])))
+    try:
+        # The SDK retries rate limits/timeouts with exponential backoff
+        resp = await client.chat.completions.create(**body)
+        query = (resp.choices[0].message.content or "").strip()
+    except Exception as e:
+        return _synth_query(*plan)
+    if cache and query:
+        cache.put(key, query)
+    return query
+
+
+def _generate_queries_batch(
+    plans: List[Plan],
+    *,
+    model: str,
+    timeout_minutes: float,
+    cache: Optional[LLMCache] = None,
+    poll_interval: float = 30.0,
+    max_poll_interval: float = 600.0,
+) -> Dict[int, str]:
+    """Generate queries through the OpenAI Batch API; returns {plan index: query}.
+
+    Polls with exponential backoff. On timeout or batch failure the batch is
+    cancelled and an empty/partial mapping returned; missing plans are then
+    generated in real time by the pipeline. Cached queries are not resubmitted,
+    and plans sharing a dedup key are submitted once.
+    """
+    from clinical_rag._openai import get_client  # lazy import
+    from clinical_rag.judge_batch_api import poll_chat_batch, submit_chat_batch
+
+    queries: Dict[int, str] = {}
+    bodies: Dict[str, Dict] = {}
+    leaders: Dict[bytes, int] = {}
+    followers: Dict[int, int] = {}
+    for i, plan in enumerate(plans):
+        leader = leaders.setdefault(_dedup_key(plan), i)
+        if leader != i:
+            followers[i] = leader
+            continue
+        body = _generation_body(plan, model)
+        cached = cache.get(_generation_cache_key(body)) if cache else None
+        if cached is not None:
+            queries[i] = cached
+        else:
+            bodies[f"gold-{i}"] = body
+    if not bodies:
+        return _fill_followers(queries, followers)
+
+    client = get_client()
+    batch_id = submit_chat_batch(bodies, client=client, filename="gold_batch.jsonl")
+    print(f"Submitted generation batch {batch_id} ({len(bodies)} requests)")
+
+    deadline = time.monotonic() + timeout_minutes * 60
+    contents: Optional[Dict[str, str]] = None
+    while True:
+        try:
+            contents = poll_chat_batch(batch_id, client=client)
+        except RuntimeError as exc:
+            print(f"{exc}; generating in real time instead")
+            break
+        if contents is not None:
+            break
+        if time.monotonic() >= deadline:
+            print(
+                f"Batch {batch_id} not done after {timeout_minutes:g} min;"
+                " cancelling and generating in real time"
+            )
+            try:
+                client.batches.cancel(batch_id)
+            except Exception:
+                pass
+            break
+        time.sleep(poll_interval)
+        poll_interval = min(max_poll_interval, poll_interval * 2)
+
+    for custom_id, content in (contents or {}).items():
+        query = (content or "").strip()
+        if query:
+            queries[int(custom_id.rsplit("-", 1)[1])] = query
+            if cache:
+                cache.put(_generation_cache_key(bodies[custom_id]), query)
+    return _fill_followers(queries, followers)
+
+
+def _fill_followers(
+    queries: Dict[int, str], followers: Dict[int, int]
+) -> Dict[int, str]:
+    for i, leader in followers.items():
+        if leader in queries:
+            queries[i] = queries[leader]
+    return queries
+
+
+async def _parse_row(
+    plan: Plan,
+    query: str,
+    *,
+    model: str,
+    snapshot: str,
+    rpm: "AsyncRateLimiter",
+    client: "OpenAI",
+    cache: Optional[LLMCache] = None,
+) -> Dict:
+    t, age, sex_word, loc = plan
+    # Keyed on the parser prompt too, so editing it invalidates old entries
+    key = cache_key("parse", model, _PARSER_PROMPT, " ".join(query.split()))
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        query_spec = _DECODER.decode(cached)
+    else:
+        await rpm.acquire()
+        try:
+            query_spec = await asyncio.to_thread(
+                parse_query, query, llm_model=model, client=client
+            )
+        except Exception as e:
+            raise RuntimeError(
+                f"Failed to parse generated query for {t.get('nct_id')}: {e}"
+            ) from e
+        if cache:
+            cache.put(key, _ENCODER.encode(query_spec))
+    return {
+        "query_spec": query_spec,
+        "query": query,
+        "nct_id": t.get("nct_id"),
+        "snapshot": snapshot,
+        "title": t.get("trial_title"),
+        "sex": sex_word,
+        "age": age,
+        "location": loc,
+        "conditions": t.get("conditions") or [],
+        "interventions": t.get("interventions") or [],
+    }
+
+
+# Max rows joined into one write() call, and the output file buffer size
+_WRITE_BATCH_ROWS = 100
+_WRITE_BUFFER = 1 << 20
+
+
+async def _generate_all(
+    plans: List[Plan],
+    out_path: Path,
+    *,
+    model: str,
+    snapshot: str,
+    gen_concurrency: int,
+    parse_concurrency: int,
+    max_rpm: float,
+    max_tpm: float,
+    pregenerated: Optional[Dict[int, str]] = None,
+    cache: Optional[LLMCache] = None,
+) -> int:
+    """Two-stage pipeline: generate queries -> parse them -> stream rows to disk.
+
+    Each stage has its own worker pool, so parsing of earlier trials overlaps
+    generation of later ones. Rows are written in completion order. Queries in
+    `pregenerated` (keyed by plan index, e.g. from the Batch API) skip the
+    generation call, and plans sharing a dedup key await one shared request.
+    """
+    pregenerated = pregenerated or {}
+    from clinical_rag._openai import (  # lazy import
+        AsyncRateLimiter,
+        get_client,
+        new_async_client,
+    )
+
+    gen_concurrency = max(1, gen_concurrency)
+    parse_concurrency = max(1, parse_concurrency)
+    # Both stages share one request budget; only generation is token-throttled
+    rpm = AsyncRateLimiter(max_rpm, 60.0)
+    tpm = AsyncRateLimiter(max_tpm, 60.0)
+
+    q_plans: asyncio.Queue = asyncio.Queue()
+    for item in enumerate(plans):
+        q_plans.put_nowait(item)
+    for _ in range(gen_concurrency):
+        q_plans.put_nowait(None)
+    # Bounded so generation can't run arbitrarily far ahead of parsing
+    q_generated: asyncio.Queue = asyncio.Queue(maxsize=2 * parse_concurrency)
+    q_parsed: asyncio.Queue = asyncio.Queue()
+    # One pooled sync client for every parser thread
+    parse_client = get_client()
+    # dedup key -> in-flight or finished generation, shared by duplicate plans
+    inflight: Dict[bytes, asyncio.Task] = {}
+
+    async with new_async_client() as client:
+
+        async def generate_worker() -> None:
+            while (item := await q_plans.get()) is not None:
+                i, plan = item
+                query = pregenerated.get(i)
+                if query is None:
+                    key = _dedup_key(plan)
+                    task = inflight.get(key)
+                    if task is None:
+                        task = inflight[key] = asyncio.create_task(
+                            _generate_query(
+                                client, plan, model=model, rpm=rpm, tpm=tpm, cache=cache
+                            )
+                        )
+                    # Shielded so one cancelled waiter can't cancel the others' call
+                    query = await asyncio.shield(task)
+                await q_generated.put((plan, query))
+
+        async def parse_worker() -> None:
+            while (item := await q_generated.get()) is not None:
+                plan, query = item
+                try:
+                    row = await _parse_row(
+                        plan,
+                        query,
+                        model=model,
+                        snapshot=snapshot,
+                        rpm=rpm,
+                        client=parse_client,
+                        cache=cache,
+                    )
+                    # Encode in the worker, keeping JSON work off the writer
+                    line = _ENCODER.encode(row).encode("utf-8") + b"\n"
+                except Exception as e:
+                    line = e  # surfaced by the writer below
+                await q_parsed.put(line)
+
+        async def close_parse_stage() -> None:
+            await asyncio.gather(*gen_tasks)
+            for _ in range(parse_concurrency):
+                await q_generated.put(None)
+
+        gen_tasks = [
+            asyncio.create_task(generate_worker()) for _ in range(gen_concurrency)
+        ]
+        tasks = [
+            *gen_tasks,
+            *(asyncio.create_task(parse_worker()) for _ in range(parse_concurrency)),
+            asyncio.create_task(close_parse_stage()),
+        ]
+
+        written = 0
+        total = len(plans)
+        start_ts = time.time()
+        try:
+            with out_path.open("wb", buffering=_WRITE_BUFFER) as f:
+                while written < total:
+                    # Batch every row already parsed into a single write()
+                    lines = [await q_parsed.get()]
+                    while len(lines) < _WRITE_BATCH_ROWS and not q_parsed.empty():
+                        lines.append(q_parsed.get_nowait())
+                    for i, line in enumerate(lines):
+                        if isinstance(line, Exception):
+                            f.write(b"".join(lines[:i]))
+                            raise line
+                    f.write(b"".join(lines))
+                    before = written
+                    written += len(lines)
+
+                    # lightweight progress indicator
+                    if written // 10 > before // 10 or written == total:
+                        elapsed = max(1e-6, time.time() - start_ts)
+                        rate = written / elapsed
+                        pct = (written / total) * 100.0 if total else 100.0
+                        eta = (total - written) / rate if rate > 0 else 0.0
+                        print(
+                            f"\rProgress: {written}/{total} ({pct:5.1f}%) | {rate:4.1f} qps | ETA {eta:5.1f}s",
+                            end="",
+                            flush=True,
+                        )
+        finally:
+            for task in (*tasks, *inflight.values()):
+                task.cancel()
+            await asyncio.gather(*tasks, *inflight.values(), return_exceptions=True)
+    return written
+
+
+def main_api(
+    *,
+    snapshot: str = "LATEST",
+    num: int = 1000,
+    seed: int = 42,
+    model: str = "gpt-4o-mini",
+    output_path: str | Path = "eval/gold_retrieval.jsonl",
+    gen_concurrency: int = 16,
+    parse_concurrency: int = 16,
+    max_rpm: float = 500,
+    max_tpm: float = 200_000,
+    batch: bool = False,
+    batch_timeout_minutes: float = 24 * 60,
+    use_cache: bool = True,
+) -> int:
+    """Programmatic entry point mirroring the CLI; returns the rows written.
+
+    Lets callers such as `eval.main` run generation in-process, reusing the
+    already-imported modules and shared OpenAI client.
+    """
+    if not os.getenv("OPENAI_API_KEY"):
+        raise RuntimeError("OPENAI_API_KEY is required for query parsing")
+
+    rng = random.Random(seed)
+
+    base = Path("data") / "snapshots"
+    snap_dir = Path(snapshot) if snapshot != "LATEST" else _find_latest_snapshot(base)
+    trials_path = snap_dir / "trials.jsonl"
+    if not trials_path.exists():
+        raise FileNotFoundError(f"trials.jsonl not found in snapshot: {snap_dir}")
+
+    if num <= 0:
+        # Dry run: validate the snapshot path without reading it
+        print(f"Nothing to generate (num={num}); snapshot: {snap_dir}")
+        return 0
+
+    sample, seen = _reservoir_sample(_load_trials(trials_path), num, rng=rng)
+    if not seen:
+        raise RuntimeError("No trials found in snapshot")
+
+    out_path = Path(output_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Draw guidance values up front, in sample order, so runs stay reproducible
+    # regardless of the order in which requests complete
+    ages, sex_words = _choose_ages_and_sexes(sample, rng=np.random.default_rng(seed))
+    plans: List[Plan] = [
+        (t, age, sex_word, _choose_location(t.get("locations") or [], rng=rng))
+        for t, age, sex_word in zip(sample, ages, sex_words)
+    ]
+    plans, duplicates = _dedup_plans(plans)
+    if duplicates:
+        print(f"{duplicates} near-duplicate trials will share generation calls")
+
+    cache = LLMCache() if use_cache else None
+    try:
+        pregenerated = (
+            _generate_queries_batch(
+                plans,
+                model=model,
+                timeout_minutes=batch_timeout_minutes,
+                cache=cache,
+            )
+            if batch
+            else None
+        )
+
+        written = asyncio.run(
+            _generate_all(
+                plans,
+                out_path,
+                model=model,
+                snapshot=snap_dir.name,
+                gen_concurrency=gen_concurrency,
+                parse_concurrency=parse_concurrency,
+                max_rpm=max_rpm,
+                max_tpm=max_tpm,
+                pregenerated=pregenerated,
+                cache=cache,
+            )
+        )
+    finally:
+        if cache:
+            cache.close()
+
+    # finalize progress line
+    print()
+
+    print(f"Gold dataset written: {out_path} (rows={written})")
+    return written
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Generate gold-standard retrieval dataset from snapshot trials"
@@ -172,108 +701,62 @@ def main() -> None:
         default="eval/gold_retrieval.jsonl",
         help="Output JSONL path",
     )
+    parser.add_argument(
+        "--gen-concurrency",
+        type=int,
+        default=16,
+        help="Concurrent query-generation requests",
+    )
+    parser.add_argument(
+        "--parse-concurrency",
+        type=int,
+        default=16,
+        help="Concurrent query-parsing requests",
+    )
+    parser.add_argument(
+        "--max-requests-per-minute",
+        type=float,
+        default=500,
+        help="Throttle for generation + parsing requests",
+    )
+    parser.add_argument(
+        "--max-tokens-per-minute",
+        type=float,
+        default=200_000,
+        help="Throttle for estimated generation tokens",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate queries via the OpenAI Batch API (~50%% cheaper, offline)",
+    )
+    parser.add_argument(
+        "--batch-timeout-minutes",
+        type=float,
+        default=24 * 60,
+        help="Give up on the batch after this long and generate in real time",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Bypass the on-disk generation/parse cache ({DEFAULT_CACHE_PATH})",
+    )
     args = parser.parse_args()
 
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is required for query parsing")
-
-    rng = random.Random(args.seed)
-
-    base = Path("data") / "snapshots"
-    snap_dir = (
-        Path(args.snapshot)
-        if args.snapshot != "LATEST"
-        else _find_latest_snapshot(base)
+    main_api(
+        snapshot=args.snapshot,
+        num=args.num,
+        seed=args.seed,
+        model=args.model,
+        output_path=args.output,
+        gen_concurrency=args.gen_concurrency,
+        parse_concurrency=args.parse_concurrency,
+        max_rpm=args.max_requests_per_minute,
+        max_tpm=args.max_tokens_per_minute,
+        batch=args.batch,
+        batch_timeout_minutes=args.batch_timeout_minutes,
+        use_cache=not args.no_cache,
     )
-    trials_path = snap_dir / "trials.jsonl"
-    if not trials_path.exists():
-        raise FileNotFoundError(f"trials.jsonl not found in snapshot: {snap_dir}")
-
-    trials = list(_load_trials(trials_path))
-    if not trials:
-        raise RuntimeError("No trials found in snapshot")
-
-    rng.shuffle(trials)
-    sample = trials[: max(0, min(args.num, len(trials)))]
-
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    from openai import OpenAI  # lazy import
-
-    client = OpenAI()
-
-    written = 0
-    total = len(sample)
-    start_ts = time.time()
-    with out_path.open("w", encoding="utf-8") as f:
-        for idx, t in enumerate(sample, start=1):
-            # Prepare guidance values
-            min_age = t.get("min_age_years") or t.get("min_age")
-            max_age = t.get("max_age_years") or t.get("max_age")
-            age = _choose_age(
-                min_age if isinstance(min_age, int) else None,
-                max_age if isinstance(max_age, int) else None,
-                rng=rng,
-            )
-            sex_word = _choose_sex(t.get("sex") or t.get("gender"), rng=rng)
-            loc = _choose_location(t.get("locations") or [], rng=rng)
-
-            # Build query via LLM with synth fallback on error
-            sys, user = _build_llm_prompt(t, age, sex_word, loc)
-            try:
-                resp = client.chat.completions.create(
-                    model=args.model,
-                    messages=[
-                        {"role": "system", "content": sys},
-                        {"role": "user", "content": user},
-                    ],
-                    temperature=0.2,
-                )
-                query = (resp.choices[0].message.content or "").strip()
-            except Exception as e:
-                query = _synth_query(t, age, sex_word, loc)
-
-            try:
-                query_spec = parse_query(query, llm_model=args.model)
-            except Exception as e:
-                raise RuntimeError(
-                    f"Failed to parse generated query for {t.get('nct_id')}: {e}"
-                ) from e
-
-            row = {
-                "query_spec": query_spec,
-                "query": query,
-                "nct_id": t.get("nct_id"),
-                "snapshot": snap_dir.name,
-                "title": t.get("trial_title"),
-                "sex": sex_word,
-                "age": age,
-                "location": loc,
-                "conditions": t.get("conditions") or [],
-                "interventions": t.get("interventions") or [],
-            }
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
-            written += 1
-
-            # lightweight progress indicator
-            if idx % 10 == 0 or idx == total:
-                elapsed = max(1e-6, time.time() - start_ts)
-                rate = idx / elapsed
-                pct = (idx / total) * 100.0 if total else 100.0
-                eta = (total - idx) / rate if rate > 0 else 0.0
-                print(
-                    f"\rProgress: {idx}/{total} ({pct:5.1f}%) | {rate:4.1f} qps | ETA {eta:5.1f}s",
-                    end="",
-                    flush=True,
-                )
-                # polite pacing for API
-                time.sleep(0.05)
-
-    # finalize progress line
-    print()
-
-    print(f"Gold dataset written: {out_path} (rows={written})")
 
 
 if __name__ == "__main__":
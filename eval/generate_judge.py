@@ -11,11 +11,19 @@ Each input row must include a `query_spec` field (dict or JSON string). For each
 row the script:
   1. Reuses the parsed spec to retrieve top-K trials via
      `clinical_rag.retrieval.retrieve_with_exclusions`.
-  2. Runs the grouped trials through `clinical_rag.judge.judge_grouped`, which
-     performs a single LLM call to classify eligibility for all trials.
+  2. Runs the grouped trials through `clinical_rag.judge.ajudge_grouped` (the
+     async `judge_grouped`), which performs a single LLM call to classify
+     eligibility for all trials.
   3. Writes a JSONL record containing the original row fields, serialized
      retrieval context, and judge outputs.
 
+Rows flow through concurrent retrieval and judge stages
+(--retrieval-concurrency / --judge-concurrency) and are written in completion
+order. By default each query gets its own judge call, as in the app; pass
+--judge-batch-size > 1 to pack waiting queries into one LLM call
+(`clinical_rag.judge.ajudge_batch`), which is cheaper but scores a
+multi-patient prompt the app never sends.
+
 The resulting dataset can be used to evaluate judge accuracy offline without
 re-running retrieval or additional judgement calls.
 """
@@ -23,33 +31,41 @@ re-running retrieval or additional judgement calls.
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 import os
+import threading
 import time
+from itertools import chain, islice
+from operator import attrgetter
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional
+from typing import Dict, Iterable, List, Optional
 
 from clinical_rag.retrieval import retrieve_with_exclusions
-from clinical_rag.judge import judge_grouped
 
 
-def _iter_jsonl(path: Path) -> Iterator[Dict]:
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                yield json.loads(line)
-            except Exception:
-                continue
+# Reused for every JSONL row instead of json.loads/json.dumps per call
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+_DECODER = json.JSONDecoder()
+
+
+def _count_lines(path: Path) -> int:
+    """Count lines with a chunked byte scan (no decoding or JSON parsing)."""
+    count = 0
+    last = b"\n"
+    with path.open("rb") as fh:
+        for buf in iter(lambda: fh.read(1 << 20), b""):
+            count += buf.count(b"\n")
+            last = buf[-1:]
+    # A final line without a trailing newline still counts
+    return count + (last != b"\n")
 
 
 def _load_spec(row: Dict, *, row_index: int) -> Dict:
     spec = row.get("query_spec")
     if isinstance(spec, str):
         try:
-            spec = json.loads(spec)
+            spec = _DECODER.decode(spec)
         except json.JSONDecodeError as e:
             raise ValueError(f"Row {row_index} has invalid query_spec JSON") from e
     if not isinstance(spec, dict):
@@ -57,24 +73,25 @@ def _load_spec(row: Dict, *, row_index: int) -> Dict:
     return spec
 
 
+_get_payload = attrgetter("payload")
+
+
 def _serialize_bullets(bullets: Iterable, *, limit: Optional[int]) -> List[Dict]:
-    serialized: List[Dict] = []
-    bullet_list = bullets if isinstance(bullets, list) else list(bullets)
+    # Bullets are retrieval hit wrappers, which always carry a `payload` slot
     if limit is not None and limit > 0:
-        bullet_list = bullet_list[:limit]
-    for b in bullet_list:
-        payload = getattr(b, "payload", None) or {}
-        serialized.append(
-            {
-                "chunk_id": payload.get("chunk_id"),
-                "text": payload.get("text"),
-            }
-        )
-    return serialized
+        bullets = islice(bullets, limit)
+    return [
+        {"chunk_id": (p := _get_payload(b) or {}).get("chunk_id"), "text": p.get("text")}
+        for b in bullets
+    ]
 
 
 def _representative_payload(ctx: Dict[str, List]) -> Dict:
-    for h in ctx.get("incl", []) + ctx.get("excl", []):
+    # retrieve_with_exclusions already attaches the shared trial fields
+    info = ctx.get("info")
+    if info:
+        return info
+    for h in chain(ctx.get("incl", ()), ctx.get("excl", ())):
         payload = getattr(h, "payload", None)
         if payload:
             return payload
@@ -123,6 +140,285 @@ def _rank_of(target: Optional[str], ranking: List[str]) -> Optional[int]:
         return None
 
 
+def _build_record(
+    row: Dict,
+    spec: Dict,
+    grouped: Dict[str, Dict[str, List]],
+    judge_output: List[Dict],
+    *,
+    k: int,
+    model: str,
+    max_incl: Optional[int],
+    max_excl: Optional[int],
+) -> Dict:
+    ranking = list(grouped.keys())
+    return {
+        "query": row.get("query"),
+        "query_spec": spec,
+        "target_nct_id": row.get("nct_id"),
+        "target_rank": _rank_of(row.get("nct_id"), ranking),
+        "snapshot": row.get("snapshot"),
+        "retrieval_k": k,
+        "retrieved_nct_ids": ranking,
+        "retrieved_trials": _serialize_grouped(
+            grouped, max_incl=max_incl, max_excl=max_excl
+        ),
+        "judge_model": model,
+        "judge_results": judge_output,
+    }
+
+
+_DONE = object()
+
+# Output rows are written in chunks of up to this many through a 1 MiB buffer
+_WRITE_BATCH_ROWS = 100
+_WRITE_BUFFER = 1 << 20
+
+
+async def _run_pipeline(
+    input_path: Path,
+    output_path: Path,
+    *,
+    k: int,
+    model: str,
+    limit: Optional[int],
+    max_incl: Optional[int],
+    max_excl: Optional[int],
+    retrieval_concurrency: int,
+    judge_concurrency: int,
+    judge_batch_size: int,
+    total_rows: int,
+    log_interval: int,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """Read rows -> retrieve (threads) -> judge (async LLM) -> write, concurrently.
+
+    Each stage has its own worker pool joined by bounded queues; records are
+    written in completion order. Returns the number of rows written. Setting
+    `stop` from another thread aborts the run with a RuntimeError.
+    """
+    from clinical_rag._openai import new_async_client  # lazy import
+    from clinical_rag.judge import ajudge_batch, ajudge_grouped
+
+    retrieval_concurrency = max(1, retrieval_concurrency)
+    judge_concurrency = max(1, judge_concurrency)
+    judge_batch_size = max(1, judge_batch_size)
+    q_rows: asyncio.Queue = asyncio.Queue(maxsize=2 * retrieval_concurrency)
+    q_retrieved: asyncio.Queue = asyncio.Queue(maxsize=2 * judge_concurrency)
+    q_out: asyncio.Queue = asyncio.Queue()
+
+    async def read_rows() -> None:
+        queued = 0
+        with input_path.open("r", encoding="utf-8") as fin:
+            for idx, line in enumerate(fin, start=1):
+                if limit is not None and queued >= limit:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = _DECODER.decode(line)
+                except Exception:
+                    continue
+                await q_rows.put((row, _load_spec(row, row_index=idx)))
+                queued += 1
+
+    async def retrieve_worker() -> None:
+        while (item := await q_rows.get()) is not _DONE:
+            row, spec = item
+            grouped = await asyncio.to_thread(
+                retrieve_with_exclusions, spec, max_trials=k
+            )
+            await q_retrieved.put((row, spec, grouped))
+
+    async def judge_worker(client) -> None:
+        done = False
+        while not done:
+            item = await q_retrieved.get()
+            if item is _DONE:
+                break
+            # Pack whatever else is already waiting, up to judge_batch_size
+            pack = [item]
+            while len(pack) < judge_batch_size:
+                try:
+                    item = q_retrieved.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                pack.append(item)
+
+            if len(pack) == 1:
+                _, spec, grouped = pack[0]
+                outputs = [
+                    await ajudge_grouped(spec, grouped, model=model, client=client)
+                ]
+            else:
+                outputs = await ajudge_batch(
+                    [(spec, grouped) for _, spec, grouped in pack],
+                    model=model,
+                    client=client,
+                )
+            for (row, spec, grouped), judge_output in zip(pack, outputs):
+                record = _build_record(
+                    row,
+                    spec,
+                    grouped,
+                    judge_output,
+                    k=k,
+                    model=model,
+                    max_incl=max_incl,
+                    max_excl=max_excl,
+                )
+                # Encode here so JSON work is spread over the judge workers
+                await q_out.put(_ENCODER.encode(record).encode("utf-8") + b"\n")
+
+    async def run_stage(
+        workers: List[asyncio.Task], downstream: asyncio.Queue, n: int
+    ) -> None:
+        # Propagate the first failure to the writer; otherwise close downstream
+        try:
+            await asyncio.gather(*workers)
+        except Exception as e:
+            await q_out.put(e)
+            return
+        for _ in range(n):
+            await downstream.put(_DONE)
+
+    async def watch_stop() -> None:
+        # Polled, since waiting on the Event in a thread could not be cancelled
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+        await q_out.put(RuntimeError("Judge generation stopped before completion"))
+
+    processed = 0
+    start_ts = time.time()
+    async with new_async_client() as client:
+        reader = [asyncio.create_task(read_rows())]
+        retrievers = [
+            asyncio.create_task(retrieve_worker()) for _ in range(retrieval_concurrency)
+        ]
+        judges = [
+            asyncio.create_task(judge_worker(client)) for _ in range(judge_concurrency)
+        ]
+        stages = [
+            asyncio.create_task(run_stage(reader, q_rows, retrieval_concurrency)),
+            asyncio.create_task(
+                run_stage(retrievers, q_retrieved, judge_concurrency)
+            ),
+            asyncio.create_task(run_stage(judges, q_out, 1)),
+        ]
+        tasks = [*reader, *retrievers, *judges, *stages]
+        if stop is not None:
+            tasks.append(asyncio.create_task(watch_stop()))
+        try:
+            with output_path.open("wb", buffering=_WRITE_BUFFER) as fout:
+                done = False
+                while not done:
+                    # Drain whatever is ready so one write() covers many rows
+                    chunk = [await q_out.get()]
+                    while len(chunk) < _WRITE_BATCH_ROWS and not q_out.empty():
+                        chunk.append(q_out.get_nowait())
+                    lines: List[bytes] = []
+                    for item in chunk:
+                        if item is _DONE:
+                            done = True
+                            break
+                        if isinstance(item, Exception):
+                            fout.write(b"".join(lines))
+                            raise item
+                        lines.append(item)
+                    fout.write(b"".join(lines))
+
+                    before = processed
+                    processed += len(lines)
+                    if (
+                        log_interval > 0
+                        and processed // log_interval > before // log_interval
+                    ):
+                        elapsed = max(1e-6, time.time() - start_ts)
+                        rate = processed / elapsed
+                        eta = (total_rows - processed) / rate if total_rows else 0.0
+                        pct = (processed / total_rows * 100.0) if total_rows else 100.0
+                        print(
+                            f"Processed {processed}/{total_rows or '?'} ({pct:5.1f}%)"
+                            f" | {rate:4.2f} rows/s | ETA {eta:6.1f}s",
+                            end="\r",
+                            flush=True,
+                        )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return processed
+
+
+def main_api(
+    *,
+    input_path: str | Path = "eval/gold_retrieval.jsonl",
+    output_path: str | Path = "eval/gold_judge.jsonl",
+    k: int = 10,
+    model: str = "gpt-4o-mini",
+    limit: int = 0,
+    max_inclusion: int = 40,
+    max_exclusion: int = 40,
+    log_interval: int = 10,
+    retrieval_concurrency: int = 8,
+    judge_concurrency: int = 16,
+    judge_batch_size: int = 1,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """Programmatic entry point mirroring the CLI; returns the rows written.
+
+    Used by `eval.main` so the judge stage runs in the same process as gold
+    generation and reuses its imports, embedder and clients. Setting `stop`
+    (e.g. from another thread) aborts the run with a RuntimeError; rows
+    already written are kept.
+    """
+    if not os.getenv("OPENAI_API_KEY"):
+        raise RuntimeError("OPENAI_API_KEY is required for judge evaluation")
+
+    input_path = Path(input_path)
+    if not input_path.exists():
+        raise FileNotFoundError(f"Input file not found: {input_path}")
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Row count for the ETA only; a raw newline count avoids parsing twice
+    total_rows = _count_lines(input_path)
+    if limit and limit > 0:
+        total_rows = min(total_rows, limit)
+
+    start_ts = time.time()
+    processed = asyncio.run(
+        _run_pipeline(
+            input_path,
+            output_path,
+            k=k,
+            model=model,
+            limit=limit if limit and limit > 0 else None,
+            max_incl=None if max_inclusion <= 0 else max_inclusion,
+            max_excl=None if max_exclusion <= 0 else max_exclusion,
+            retrieval_concurrency=retrieval_concurrency,
+            judge_concurrency=judge_concurrency,
+            judge_batch_size=judge_batch_size,
+            total_rows=total_rows,
+            log_interval=log_interval,
+            stop=stop,
+        )
+    )
+
+    elapsed = time.time() - start_ts
+    print()
+    print(
+        f"Judge dataset written: {output_path} (rows={processed}, elapsed={elapsed:0.1f}s,"
+        f" avg={(processed / elapsed) if elapsed else 0.0:0.2f} rows/s)"
+    )
+    return processed
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Generate judge evaluation dataset from gold retrieval queries"
@@ -169,85 +465,41 @@ def main() -> None:
     parser.add_argument(
         "--log-interval", type=int, default=10, help="Progress log frequency in rows"
     )
+    parser.add_argument(
+        "--retrieval-concurrency",
+        type=int,
+        default=8,
+        help="Concurrent Qdrant retrievals",
+    )
+    parser.add_argument(
+        "--judge-concurrency",
+        type=int,
+        default=16,
+        help="Concurrent judge LLM calls",
+    )
+    parser.add_argument(
+        "--judge-batch-size",
+        type=int,
+        default=1,
+        help=(
+            "Max queries packed into one judge call "
+            "(1 = one call per query, as in the app)"
+        ),
+    )
     args = parser.parse_args()
 
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is required for judge evaluation")
-
-    input_path = Path(args.input)
-    if not input_path.exists():
-        raise FileNotFoundError(f"Input file not found: {input_path}")
-
-    output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    total_rows = 0
-    processed = 0
-    for _ in _iter_jsonl(input_path):
-        total_rows += 1
-        if args.limit and args.limit > 0 and total_rows >= args.limit:
-            break
-    if args.limit and args.limit > 0:
-        total_rows = min(total_rows, args.limit)
-
-    start_ts = time.time()
-    with (
-        input_path.open("r", encoding="utf-8") as fin,
-        output_path.open("w", encoding="utf-8") as fout,
-    ):
-        for idx, line in enumerate(fin, start=1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                row = json.loads(line)
-            except Exception:
-                continue
-
-            if args.limit and processed >= args.limit:
-                break
-
-            spec = _load_spec(row, row_index=idx)
-            grouped = retrieve_with_exclusions(spec, max_trials=args.k)
-            ranking = list(grouped.keys())
-            judge_output = judge_grouped(spec, grouped, model=args.model)
-
-            serialized = {
-                "query": row.get("query"),
-                "query_spec": spec,
-                "target_nct_id": row.get("nct_id"),
-                "target_rank": _rank_of(row.get("nct_id"), ranking),
-                "snapshot": row.get("snapshot"),
-                "retrieval_k": args.k,
-                "retrieved_nct_ids": ranking,
-                "retrieved_trials": _serialize_grouped(
-                    grouped,
-                    max_incl=None if args.max_inclusion <= 0 else args.max_inclusion,
-                    max_excl=None if args.max_exclusion <= 0 else args.max_exclusion,
-                ),
-                "judge_model": args.model,
-                "judge_results": judge_output,
-            }
-            fout.write(json.dumps(serialized, ensure_ascii=False) + "\n")
-
-            processed += 1
-            if args.log_interval > 0 and processed % args.log_interval == 0:
-                elapsed = max(1e-6, time.time() - start_ts)
-                rate = processed / elapsed
-                eta = (total_rows - processed) / rate if total_rows else 0.0
-                pct = (processed / total_rows * 100.0) if total_rows else 100.0
-                print(
-                    f"Processed {processed}/{total_rows or '?'} ({pct:5.1f}%)"
-                    f" | {rate:4.2f} rows/s | ETA {eta:6.1f}s",
-                    end="\r",
-                    flush=True,
-                )
-
-    elapsed = time.time() - start_ts
-    print()
-    print(
-        f"Judge dataset written: {output_path} (rows={processed}, elapsed={elapsed:0.1f}s,"
-        f" avg={(processed / elapsed) if elapsed else 0.0:0.2f} rows/s)"
+    main_api(
+        input_path=args.input,
+        output_path=args.output,
+        k=args.k,
+        model=args.model,
+        limit=args.limit,
+        max_inclusion=args.max_inclusion,
+        max_exclusion=args.max_exclusion,
+        log_interval=args.log_interval,
+        retrieval_concurrency=args.retrieval_concurrency,
+        judge_concurrency=args.judge_concurrency,
+        judge_batch_size=args.judge_batch_size,
     )
 
 
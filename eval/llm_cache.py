@@ -0,0 +1,59 @@
+"""Persistent exact-match cache for LLM responses used by the eval scripts.
+
+A single SQLite file (default `eval/.llmcache.sqlite`) maps a hash of
+(namespace, model, prompt parts) to the raw response text, so re-running a
+generation with the same seed and model skips calls already answered.
+Pass `--no-cache` to the scripts to bypass it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+import sqlite3
+from typing import Optional
+
+DEFAULT_CACHE_PATH = Path("eval") / ".llmcache.sqlite"
+
+
+def cache_key(namespace: str, model: str, *parts: str) -> str:
+    h = hashlib.sha256()
+    for part in (namespace, model, *parts):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class LLMCache:
+    """Tiny key/value store on SQLite; use from one thread (the event loop)."""
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, value)
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "LLMCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
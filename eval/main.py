@@ -6,6 +6,11 @@ Steps:
 3. Generate judge evaluation data (`eval.generate_judge`).
 4. Execute the judge evaluation notebook.
 
+Steps 1 and 3 are called in-process through each module's `main_api`, so the
+imported clients and models are shared instead of re-initialised per step.
+Steps 2 and 3 only depend on step 1, so they run concurrently unless
+`--sequential` is given.
+
 Usage:
   uv run python -m eval.main [options]
 """
@@ -13,9 +18,9 @@ Usage:
 from __future__ import annotations
 
 import argparse
-import runpy
-import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import threading
 
 from dotenv import load_dotenv
 import nbformat
@@ -24,17 +29,6 @@ from nbclient import NotebookClient
 from clinical_rag.config import load_settings
 
 
-def _run_cli_module(module: str, argv: list[str]) -> None:
-    """Invoke a module's CLI `main()` by temporarily swapping `sys.argv`."""
-
-    old_argv = sys.argv
-    sys.argv = [module.split(".")[-1], *argv]
-    try:
-        runpy.run_module(module, run_name="__main__")
-    finally:
-        sys.argv = old_argv
-
-
 def _execute_notebook(path: Path, *, timeout: int, save_output: bool) -> None:
     """Run a notebook in-process via nbclient and optionally persist outputs."""
 
@@ -114,11 +108,22 @@ def main(argv: list[str] | None = None) -> None:
         action="store_true",
         help="Persist executed notebook copies alongside originals",
     )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Run the retrieval notebook and judge data generation one after another",
+    )
 
     args = parser.parse_args(argv)
 
     # Load environment variables for downstream modules (e.g., OpenAI/Qdrant creds)
     load_dotenv()
+    # Settings may already be cached from import time, before .env was loaded
+    load_settings.cache_clear()
+
+    # Imported only now, so nothing they pull in can read settings before .env
+    from eval.generate_gold import main_api as generate_gold
+    from eval.generate_judge import main_api as generate_judge
 
     settings = load_settings()
     print(
@@ -129,42 +134,52 @@ def main(argv: list[str] | None = None) -> None:
     )
 
     # Step 1: generate gold retrieval dataset
-    gold_args = [
-        "--snapshot",
-        args.snapshot,
-        "--num",
-        str(args.num_queries),
-        "--seed",
-        str(args.seed),
-        "--model",
-        args.query_model,
-        "--output",
-        args.gold_output,
-    ]
     print("[1/4] Generating gold retrieval dataset...")
-    _run_cli_module("eval.generate_gold", gold_args)
-
-    # Step 2: execute retrieval evaluation notebook
-    print("[2/4] Executing retrieval evaluation notebook...")
-    _execute_notebook(
-        Path(args.retrieval_notebook),
-        timeout=args.notebook_timeout,
-        save_output=args.save_notebook_outputs,
-    )
-
-    # Step 3: generate judge evaluation dataset
-    judge_args = [
-        "--input",
-        args.gold_output,
-        "--output",
-        args.judge_output,
-        "--k",
-        str(args.retrieval_k),
-        "--model",
-        args.judge_model,
-    ]
-    print("[3/4] Generating judge evaluation dataset...")
-    _run_cli_module("eval.generate_judge", judge_args)
+    generate_gold(
+        snapshot=args.snapshot,
+        num=args.num_queries,
+        seed=args.seed,
+        model=args.query_model,
+        output_path=args.gold_output,
+    )
+
+    def run_retrieval_notebook() -> None:
+        print("[2/4] Executing retrieval evaluation notebook...")
+        _execute_notebook(
+            Path(args.retrieval_notebook),
+            timeout=args.notebook_timeout,
+            save_output=args.save_notebook_outputs,
+        )
+
+    stop_judge = threading.Event()
+
+    def run_judge_generation() -> None:
+        print("[3/4] Generating judge evaluation dataset...")
+        generate_judge(
+            input_path=args.gold_output,
+            output_path=args.judge_output,
+            k=args.retrieval_k,
+            model=args.judge_model,
+            stop=stop_judge,
+        )
+
+    # Steps 2 and 3 both only read the gold dataset
+    if args.sequential:
+        run_retrieval_notebook()
+        run_judge_generation()
+    else:
+        # Judge generation runs its own event loop in the worker thread; the
+        # notebook kernel stays on the main thread
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            judge_future = pool.submit(run_judge_generation)
+            try:
+                run_retrieval_notebook()
+            except BaseException:
+                # Stop the judge run so leaving the pool doesn't wait for it
+                # to finish before the notebook error surfaces
+                stop_judge.set()
+                raise
+            judge_future.result()
 
     # Step 4: execute judge evaluation notebook
     print("[4/4] Executing judge evaluation notebook...")
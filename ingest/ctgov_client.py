@@ -4,11 +4,16 @@ Uses the v2 REST API at `/api/v2/studies`, paginating with `pageToken`
 and filtering by last update window via Essie in `query.term`.
 
 Notes:
-- Requests only `protocolSection` to limit payload size.
+- Requests only the study fields `map_study_v2` reads to limit payload size.
 - Normalizes studies into a common dict schema aligning with the PRD.
 """
 
 from datetime import date, datetime
+from functools import lru_cache
+import importlib.util
+import queue
+import re
+import threading
 from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import httpx
@@ -23,9 +28,30 @@ def _build_endpoint_v2(base: str) -> str:
     return f"{base}/v2/studies"
 
 
-# Allowed overall statuses for efficient server-side filtering (from settings)
-_SETTINGS = load_settings()
-ALLOWED_STATUSES = set(_SETTINGS.allowed_statuses)
+# Shared read-only default for absent sub-objects; never mutated
+_EMPTY: Dict[str, Any] = {}
+
+# HTTP/2 needs the optional `h2` package (httpx[http2])
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+# Exactly the paths map_study_v2 reads; large unused modules (descriptions,
+# outcomes, references, contacts, arm groups) are never sent or parsed
+_STUDY_FIELDS = "|".join(
+    (
+        "protocolSection.identificationModule.nctId",
+        "protocolSection.identificationModule.officialTitle",
+        "protocolSection.identificationModule.briefTitle",
+        "protocolSection.statusModule.overallStatus",
+        "protocolSection.conditionsModule.conditions",
+        "protocolSection.designModule.phases",
+        "protocolSection.designModule.studyType",
+        "protocolSection.armsInterventionsModule.interventions",
+        "protocolSection.eligibilityModule",
+        "protocolSection.contactsLocationsModule.locations",
+        "derivedSection.conditionBrowseModule.meshes",
+    )
+)
 
 
 def _expr_last_update_range(start: Optional[date], end: Optional[date]) -> str:
@@ -39,10 +65,12 @@ def _expr_last_update_range(start: Optional[date], end: Optional[date]) -> str:
     return f"AREA[LastUpdatePostDate]RANGE[{start_s},{end_s}]"
 
 
+@lru_cache(maxsize=1024)
 def _age_to_years(value: str) -> Optional[int]:
     """Convert age strings like '65 Years' or '18 Years' to integer years.
 
-    Returns None for 'N/A' or unparsable values.
+    Returns None for 'N/A' or unparsable values. Memoized: nearly every study
+    uses one of a few hundred distinct age strings.
     """
     if not value or value.upper() == "N/A":
         return None
@@ -75,15 +103,15 @@ def map_study_v2(study: Dict[str, Any]) -> Dict[str, object]:
     - lean structured locations with geo
     - MeSH terms from derivedSection.conditionBrowseModule
     """
-    ps = study.get("protocolSection", {}) or {}
-    ident = ps.get("identificationModule", {}) or {}
-    status = ps.get("statusModule", {}) or {}
-    conds = ps.get("conditionsModule", {}) or {}
-    design = ps.get("designModule", {}) or {}
-    arms = ps.get("armsInterventionsModule", {}) or {}
-    elig = ps.get("eligibilityModule", {}) or {}
-    locs = ps.get("contactsLocationsModule", {}) or {}
-    derived = study.get("derivedSection", {}) or {}
+    ps = study.get("protocolSection") or _EMPTY
+    ident = ps.get("identificationModule") or _EMPTY
+    status = ps.get("statusModule") or _EMPTY
+    conds = ps.get("conditionsModule") or _EMPTY
+    design = ps.get("designModule") or _EMPTY
+    arms = ps.get("armsInterventionsModule") or _EMPTY
+    elig = ps.get("eligibilityModule") or _EMPTY
+    locs = ps.get("contactsLocationsModule") or _EMPTY
+    derived = study.get("derivedSection") or _EMPTY
 
     nct_id = (ident.get("nctId") or "").strip()
     trial_title = ident.get("officialTitle") or ident.get("briefTitle") or ""
@@ -93,7 +121,7 @@ def map_study_v2(study: Dict[str, Any]) -> Dict[str, object]:
     phase = phases[0] if isinstance(phases, list) and phases else None
     conditions = conds.get("conditions") or []
     interventions: List[str] = []
-    for itv in arms.get("interventions", []) or []:
+    for itv in arms.get("interventions") or ():
         name = itv.get("name")
         if name:
             interventions.append(name)
@@ -111,8 +139,8 @@ def map_study_v2(study: Dict[str, Any]) -> Dict[str, object]:
 
     # Compose locations
     locations_struct: List[Dict[str, Any]] = []
-    for loc in locs.get("locations", []) or []:
-        gp = loc.get("geoPoint") or {}
+    for loc in locs.get("locations") or ():
+        gp = loc.get("geoPoint") or _EMPTY
         locations_struct.append(
             {
                 "city": loc.get("city"),
@@ -128,7 +156,7 @@ def map_study_v2(study: Dict[str, Any]) -> Dict[str, object]:
 
     # MeSH terms
     mesh_terms: List[str] = []
-    cb = derived.get("conditionBrowseModule", {}) or {}
+    cb = derived.get("conditionBrowseModule") or _EMPTY
     for m in cb.get("meshes") or []:
         term = m.get("term")
         if term:
@@ -160,37 +188,43 @@ def map_study_v2(study: Dict[str, Any]) -> Dict[str, object]:
     }
 
 
+_RE_EXC = re.compile(r"\n\s*exclusion criteria\s*:?\s*\n", re.I)
+_RE_INC = re.compile(r"\n\s*inclusion criteria\s*:?\s*\n", re.I)
+# Leading indent excludes newlines so a failed line start doesn't rescan the
+# following blank lines; matches are the same as with a plain `^\s*` prefix
+_RE_BULLET = re.compile(r"^[^\S\n]*(?:[-*•]|\d+\.|\([a-zA-Z]\))\s+(.+)$", re.M)
+
+
 def split_incl_excl(md: str) -> Tuple[List[str], List[str]]:
     """Heuristic splitter for inclusion/exclusion criteria markdown."""
-    import re
-
     if not md:
         return [], []
-    text = re.sub(r"\r", "", md)
+    # str.replace is a single C-level scan, and returns `md` itself when no CR
+    text = md.replace("\r", "")
     # Try Inclusion -> Exclusion path
-    m = re.split(r"\n\s*exclusion criteria\s*:?\s*\n", text, flags=re.I)
+    m = _RE_EXC.split(text)
     if len(m) == 2:
         inc_block, exc_block = m
     else:
         # Try reverse
-        m = re.split(r"\n\s*inclusion criteria\s*:?\s*\n", text, flags=re.I)
+        m = _RE_INC.split(text)
         if len(m) == 2:
             pre, inc_block = m
-            exc_split = re.split(
-                r"\n\s*exclusion criteria\s*:?\s*\n", inc_block, flags=re.I
-            )
+            exc_split = _RE_EXC.split(inc_block)
             inc_block, exc_block = (
                 (exc_split[0], exc_split[1]) if len(exc_split) == 2 else (inc_block, "")
             )
         else:
             inc_block, exc_block = text, ""
 
-    bullet = r"^\s*(?:[-*•]|\d+\.|\([a-zA-Z]\))\s+(.+)$"
-    inc = re.findall(bullet, inc_block, flags=re.M)
-    exc = re.findall(bullet, exc_block, flags=re.M)
+    inc = _RE_BULLET.findall(inc_block)
+    exc = _RE_BULLET.findall(exc_block)
     return [s.strip() for s in inc], [s.strip() for s in exc]
 
 
+_PAGE_DONE = object()
+
+
 def iter_study_fields(
     *,
     start: Optional[date],
@@ -198,40 +232,86 @@ def iter_study_fields(
     page_size: int = 100,
     timeout_s: float = 30.0,
     base_url: str = "https://clinicaltrials.gov/api/v2",
+    prefetch_pages: int = 2,
+    check_status: bool = False,
 ) -> Iterator[Dict[str, object]]:
-    """Iterate normalized study records within a date window (v2 only)."""
+    """Iterate normalized study records within a date window (v2 only).
+
+    A background thread downloads, decodes and normalizes up to
+    `prefetch_pages` pages ahead, so network waits and JSON work overlap with
+    the caller consuming records. Only the flat records cross the queue; each
+    page's raw dict tree is released as soon as it has been mapped.
+
+    Statuses are filtered server-side; pass `check_status=True` to re-check
+    each record against the allowed statuses as well.
+    """
+    allowed_statuses = load_settings().allowed_statuses
+    status_filter = "|".join(sorted(allowed_statuses))
     endpoint = _build_endpoint_v2(base_url)
     query_term = _expr_last_update_range(start, end)
-    page_token: Optional[str] = None
-    while True:
-        params = {
-            "format": "json",
-            "markupFormat": "markdown",
-            "pageSize": str(page_size),
-            # Request protocolSection and condition browse meshes for MeSH terms
-            # Use lowerCamel for derivedSection path per v2 docs; pipe-delimited list
-            "fields": "ProtocolSection|derivedSection.conditionBrowseModule.meshes",
-            "query.term": query_term,
-            # Efficient server-side status filter
-            "filter.overallStatus": "|".join(sorted(ALLOWED_STATUSES)),
-        }
-        if page_token:
-            params["pageToken"] = page_token
-
-        with httpx.Client(
-            timeout=timeout_s, headers={"User-Agent": "clinical-rag/0.1"}
-        ) as client:
-            resp = client.get(endpoint, params=params)
-            resp.raise_for_status()
-            data = resp.json()
-
-        studies = data.get("studies", []) or []
-        for st in studies:
-            rec = map_study_v2(st)
-            # Defensive client-side guard
-            if rec.get("overall_status") in ALLOWED_STATUSES:
-                yield rec
-
-        page_token = data.get("nextPageToken")
-        if not page_token:
-            break
+    pages: queue.Queue = queue.Queue(maxsize=max(1, prefetch_pages))
+    stop = threading.Event()
+
+    def put(item: object) -> None:
+        # Give up once the consumer is gone so the thread can exit
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def fetch_pages() -> None:
+        try:
+            page_token: Optional[str] = None
+            # One client for every page keeps the TLS session and connection warm
+            # (retries cover connection failures only)
+            with httpx.Client(
+                timeout=timeout_s,
+                headers={"User-Agent": "clinical-rag/0.1"},
+                transport=httpx.HTTPTransport(http2=_HTTP2, retries=3),
+            ) as client:
+                while not stop.is_set():
+                    params = {
+                        "format": "json",
+                        "markupFormat": "markdown",
+                        "pageSize": str(page_size),
+                        # lowerCamel field paths per v2 docs; pipe-delimited list
+                        "fields": _STUDY_FIELDS,
+                        "query.term": query_term,
+                        # Efficient server-side status filter
+                        "filter.overallStatus": status_filter,
+                    }
+                    if page_token:
+                        params["pageToken"] = page_token
+
+                    resp = client.get(endpoint, params=params)
+                    resp.raise_for_status()
+                    data = resp.json()
+                    records = list(map(map_study_v2, data.get("studies") or ()))
+                    if check_status:
+                        records = [
+                            rec
+                            for rec in records
+                            if rec.get("overall_status") in allowed_statuses
+                        ]
+                    put(records)
+
+                    page_token = data.get("nextPageToken")
+                    if not page_token:
+                        break
+        except Exception as exc:
+            put(exc)  # re-raised in the consuming thread
+        finally:
+            put(_PAGE_DONE)
+
+    fetcher = threading.Thread(target=fetch_pages, name="ctgov-prefetch", daemon=True)
+    fetcher.start()
+    try:
+        while (records := pages.get()) is not _PAGE_DONE:
+            if isinstance(records, Exception):
+                raise records
+            yield from records
+    finally:
+        stop.set()
+        fetcher.join()
@@ -14,12 +14,20 @@ What it does:
 from dotenv import load_dotenv
 from clinical_rag.config import load_settings
 from ingest import iter_study_fields
-from typing import Optional, List, Dict, Iterator
+from typing import IO, Optional, List, Dict, Iterator, Tuple
 from datetime import date
+from functools import lru_cache
 import argparse
+import hashlib
 import os
 import json
 from pathlib import Path
+import queue
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
 import uuid
 
 from qdrant_client import QdrantClient
@@ -27,9 +35,176 @@ from qdrant_client import models as qmodels  # for Document, VectorParams, Dista
 from qdrant_client.http import models as http_models  # for payload index schema types
 
 
+# Payload fields used in filters (see clinical_rag.retrieval.build_filters)
+_PAYLOAD_INDEXES = (
+    ("overall_status", http_models.PayloadSchemaType.KEYWORD),
+    ("gender", http_models.PayloadSchemaType.KEYWORD),
+    ("nct_id", http_models.PayloadSchemaType.KEYWORD),
+    ("min_age", http_models.PayloadSchemaType.INTEGER),
+    ("max_age", http_models.PayloadSchemaType.INTEGER),
+    ("location_cities", http_models.PayloadSchemaType.KEYWORD),
+    ("location_states", http_models.PayloadSchemaType.KEYWORD),
+    ("location_countries", http_models.PayloadSchemaType.KEYWORD),
+)
+
+
+def _ensure_payload_indexes(client: QdrantClient, collection: str) -> None:
+    """Create any missing payload indexes from _PAYLOAD_INDEXES; existing ones are skipped."""
+    try:
+        existing = client.get_collection(collection).payload_schema or {}
+    except Exception:
+        existing = {}
+    for field_name, schema in _PAYLOAD_INDEXES:
+        if field_name in existing:
+            continue
+        try:
+            client.create_payload_index(
+                collection, field_name=field_name, field_schema=schema
+            )
+            print(f"  created payload index {field_name} ({schema.value})")
+        except Exception as exc:
+            print(f"  [warn] payload index {field_name} not created: {exc}")
+
+
+# simdjson/orjson aren't dependencies, and the upsert loop reads nearly every
+# field of each record anyway, so one reusable stdlib decoder is used instead
+_DECODER = json.JSONDecoder()
+# Same for writing: a preconfigured encoder skips json.dumps' per-call setup
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def _iter_trials_file(path: Path) -> Iterator[Dict]:
+    """Stream records from a trials.jsonl file, closing it when exhausted."""
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.isspace():
+                yield _DECODER.decode(line)
+
+
+# Large write buffer so millions of small rows become a few big write() calls
+_TRIALS_BUFFER = 8 << 20
+
+
+def _close_durably(f: IO) -> None:
+    """Flush, fsync and close, so a following snapshot copies complete data."""
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+# SHA-1 state after hashing the uuid5 namespace and fixed name prefix; each id
+# only hashes the NCT id on a copy of it
+_POINT_ID_PREFIX = hashlib.sha1(uuid.NAMESPACE_URL.bytes + b"ctgov-trial:")
+
+
+def _trial_point_id(nct_id: str) -> str:
+    """Same string as str(uuid.uuid5(NAMESPACE_URL, f"ctgov-trial:{nct_id}"))."""
+    h = _POINT_ID_PREFIX.copy()
+    h.update(nct_id.encode("utf-8"))
+    b = bytearray(h.digest()[:16])
+    b[6] = (b[6] & 0x0F) | 0x50  # version 5
+    b[8] = (b[8] & 0x3F) | 0x80  # RFC 4122 variant
+    x = b.hex()
+    return f"{x[:8]}-{x[8:12]}-{x[12:16]}-{x[16:20]}-{x[20:]}"
+
+
+# Points per upsert request; keeps gRPC messages small despite large payloads
+_UPSERT_CHUNK = 256
+
+
+def _existing_point_ids(client: QdrantClient, collection: str) -> set:
+    """All point ids in `collection`, scrolled without payloads or vectors.
+
+    Point ids are derived from NCT ids (see _trial_point_id), so this doubles
+    as the set of already-ingested trials; exact, unlike a bloom filter.
+    """
+    ids: set = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection,
+            limit=10_000,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        ids.update(str(p.id) for p in points)
+        if offset is None:
+            return ids
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """Hard-link `src` into a snapshot (no data copied), else fall back to a copy.
+
+    Safe because trials.jsonl is always rewritten as a new file, never
+    truncated in place.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            shutil.copy2(src, dst)
+        except Exception:
+            pass
+
+
+def _archive_snapshot(snap_dir: Path, archive_path: Path) -> None:
+    """Write `snap_dir` as a .tar.gz archive.
+
+    Compression is piped through `pigz` on all cores when it is on PATH, and
+    falls back to single-threaded zlib otherwise; either output is plain gzip.
+    """
+    pigz = shutil.which("pigz")
+    if pigz is None:
+        with tarfile.open(archive_path, "w:gz") as tar:
+            tar.add(snap_dir, arcname=snap_dir.name)
+        return
+    with archive_path.open("wb") as out:
+        proc = subprocess.Popen(
+            [pigz, "-p", str(os.cpu_count() or 1), "-c"],
+            stdin=subprocess.PIPE,
+            stdout=out,
+        )
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                tar.add(snap_dir, arcname=snap_dir.name)
+        finally:
+            proc.stdin.close()
+            returncode = proc.wait()
+    if returncode:
+        raise RuntimeError(f"pigz exited with status {returncode}")
+
+
+@lru_cache(maxsize=65536)
+def _norm_location(value: object) -> str:
+    # City/state/country names repeat across most trials: normalize each
+    # distinct value once, and intern it so payload lists share one string
+    return sys.intern(str(value).strip().lower())
+
+
+def _summarize_locations(locs: List) -> Tuple[List[str], List[str], List[str]]:
+    """Lower-cased unique (cities, states, countries), first-seen order, one pass."""
+    cities: Dict[str, None] = {}
+    states: Dict[str, None] = {}
+    countries: Dict[str, None] = {}
+    fields = (("city", cities), ("state", states), ("country", countries))
+    for loc in locs:
+        if not isinstance(loc, dict):
+            continue
+        for key, seen in fields:
+            value = loc.get(key)
+            if value:
+                value = _norm_location(value)
+                if value:
+                    seen[value] = None
+    return list(cities), list(states), list(countries)
+
+
 def main() -> None:
     # Load variables from .env if present (no-op if missing)
     load_dotenv()
+    # Settings may already be cached from import time, before .env was loaded
+    load_settings.cache_clear()
 
     # Settings
     settings = load_settings()
@@ -50,6 +225,11 @@ def main() -> None:
         default=0,
         help="Resume upsert from this trial offset",
     )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="Skip trials already in the collection (their payloads are not refreshed)",
+    )
     parser.add_argument(
         "--ingest-only",
         action="store_true",
@@ -85,6 +265,12 @@ def main() -> None:
     parser.add_argument(
         "--parallel", type=int, default=0, help="Upload parallelism override (0 = auto)"
     )
+    parser.add_argument(
+        "--device",
+        choices=("cpu", "cuda"),
+        default="cpu",
+        help="Embedding device; cuda requires onnxruntime-gpu",
+    )
     args = parser.parse_args()
 
     start: Optional[date] = settings.data_start_date
@@ -94,18 +280,6 @@ def main() -> None:
     out_dir = Path("data")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    def _lower_unique(items):
-        out = []
-        seen = set()
-        for it in items or []:
-            if not it:
-                continue
-            val = str(it).strip().lower()
-            if val and val not in seen:
-                out.append(val)
-                seen.add(val)
-        return out
-
     # Auto-tuned defaults; overridable via flags
     cpu = os.cpu_count() or 4
     batch_size = (
@@ -177,27 +351,19 @@ def main() -> None:
         else:
             snap_dir = Path(args.upsert_from_snapshot)
         if (snap_dir / "trials.jsonl").exists():
-            trial_source = (
-                json.loads(line)
-                for line in (snap_dir / "trials.jsonl").open("r", encoding="utf-8")
-            )
+            trial_source = _iter_trials_file(snap_dir / "trials.jsonl")
         else:
             raise FileNotFoundError("Snapshot missing trials.jsonl")
     elif args.upsert_from:
         p = Path(args.upsert_from)
         if p.is_dir():
             if (p / "trials.jsonl").exists():
-                trial_source = (
-                    json.loads(line)
-                    for line in (p / "trials.jsonl").open("r", encoding="utf-8")
-                )
+                trial_source = _iter_trials_file(p / "trials.jsonl")
             else:
                 raise FileNotFoundError("Directory lacks trials.jsonl")
         else:
             if p.name.endswith("trials.jsonl"):
-                trial_source = (
-                    json.loads(line) for line in p.open("r", encoding="utf-8")
-                )
+                trial_source = _iter_trials_file(p)
             else:
                 raise FileNotFoundError("Provide trials.jsonl")
     elif args.demo:
@@ -209,7 +375,10 @@ def main() -> None:
 
     # If we are streaming from API, also write trials.jsonl for snapshotting
     if not (args.upsert_from or args.upsert_from_snapshot):
-        trials_file = trials_path.open("w", encoding="utf-8")
+        # Write a fresh inode rather than truncating in place: snapshots may
+        # hard-link the previous trials.jsonl
+        trials_path.unlink(missing_ok=True)
+        trials_file = trials_path.open("w", encoding="utf-8", buffering=_TRIALS_BUFFER)
     else:
         trials_file = None
 
@@ -218,14 +387,13 @@ def main() -> None:
         count = 0
         for rec in trial_source:
             if trials_file:
-                trials_file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                trials_file.write(_ENCODER.encode(rec) + "\n")
             count += 1
         if trials_file:
-            trials_file.close()
+            _close_durably(trials_file)
         print(f"Prepared {count} trials to {trials_path}")
         if args.snapshot:
             from datetime import datetime
-            import tarfile, shutil
 
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
             base_dir = Path("data") / "snapshots"
@@ -233,10 +401,7 @@ def main() -> None:
             snap_dir = base_dir / snap_name
             snap_dir.mkdir(parents=True, exist_ok=True)
             if trials_path.exists():
-                try:
-                    shutil.copy2(str(trials_path), str(snap_dir / trials_path.name))
-                except Exception:
-                    pass
+                _link_or_copy(trials_path, snap_dir / trials_path.name)
             manifest = {
                 "snapshot": snap_name,
                 "collection": collection,
@@ -250,80 +415,110 @@ def main() -> None:
             with (snap_dir / "manifest.json").open("w", encoding="utf-8") as mf:
                 mf.write(json.dumps(manifest, ensure_ascii=False, indent=2))
             archive_path = base_dir / f"{snap_name}.tar.gz"
-            with tarfile.open(archive_path, "w:gz") as tar:
-                tar.add(snap_dir, arcname=snap_dir.name)
+            _archive_snapshot(snap_dir, archive_path)
             print(f"Snapshot written: {snap_dir}\nArchive: {archive_path}")
         return
 
     # Initialize Qdrant only when we actually upsert (not for --chunks-only)
-    print("Upserting trials to Qdrant (FastEmbed via client.add)...")
-    client = QdrantClient(url=settings.qdrant_url, prefer_grpc=True)
+    print("Upserting trials to Qdrant (FastEmbed, pipelined uploads)...")
+    client = QdrantClient(
+        url=settings.qdrant_url,
+        grpc_port=settings.qdrant_grpc_port,
+        prefer_grpc=True,
+    )
 
     # Create collection if missing
     if not client.collection_exists(collection_name=collection):
         dim = client.get_embedding_size(model_name)
+        if settings.embedding_dim_truncate:
+            dim = min(dim, settings.embedding_dim_truncate)
         client.create_collection(
             collection_name=collection,
             vectors_config=qmodels.VectorParams(
                 size=dim, distance=qmodels.Distance.COSINE
             ),
+            # int8 scalar quantization: searches scan a 4x smaller in-RAM copy
+            # and rescore the top candidates against the original vectors
+            quantization_config=qmodels.ScalarQuantization(
+                scalar=qmodels.ScalarQuantizationConfig(
+                    type=qmodels.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                )
+            ),
         )
 
     # Create payload indexes for common filters (idempotent)
-    try:
-        client.create_payload_index(
-            collection,
-            field_name="overall_status",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="gender",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="nct_id",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="location_cities",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="location_states",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="location_countries",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-    except Exception:
-        pass
+    _ensure_payload_indexes(client, collection)
+
+    # Embed on this thread (ONNX Runtime releases the GIL and uses its own
+    # thread pool) while upload_parallel workers upsert earlier chunks over
+    # gRPC, so embedding and network I/O overlap. One embedder instance (the
+    # cached query embedder, same truncation) serves the whole run.
+    from clinical_rag.retrieval import embed_passages  # loads the ONNX model
+
+    upload_queue: queue.Queue = queue.Queue(maxsize=4)
+    upload_errors: List[Exception] = []
+    # Newest chunk, held back so it can be sent last as a write barrier
+    tail: List[List[qmodels.PointStruct]] = []
+
+    def upload_worker():
+        while (points := upload_queue.get()) is not None:
+            if upload_errors:
+                continue  # keep draining so the producer never blocks
+            try:
+                # Acknowledged once in the WAL; applying continues server-side
+                client.upsert(collection_name=collection, points=points, wait=False)
+            except Exception as e:
+                upload_errors.append(e)
+
+    uploaders = [
+        threading.Thread(target=upload_worker, name=f"qdrant-upsert-{i}", daemon=True)
+        for i in range(upload_parallel)
+    ]
+    for t in uploaders:
+        t.start()
 
     def flush_batch():
+        if upload_errors:
+            print(f"Upload batch failed: {upload_errors[0]}")
+            raise upload_errors[0]
         if not texts:
             return
-        docs = [qmodels.Document(text=t, model=model_name) for t in texts]
-        try:
-            client.upload_collection(
-                collection_name=collection,
-                vectors=docs,
-                ids=ids,
-                payload=metadata,
-                batch_size=batch_size,
-                parallel=upload_parallel,
-            )
-        except Exception as e:
-            print(f"Upload batch failed: {e}")
-            raise
+        vectors = embed_passages(texts, device=args.device)
+        points = [
+            qmodels.PointStruct(id=pid, vector=vec.tolist(), payload=payload)
+            for pid, vec, payload in zip(ids, vectors, metadata)
+        ]
+        tail.extend(
+            points[i : i + _UPSERT_CHUNK] for i in range(0, len(points), _UPSERT_CHUNK)
+        )
+        while len(tail) > 1:
+            upload_queue.put(tail.pop(0))
         texts.clear()
         ids.clear()
         metadata.clear()
 
+    def finish_uploads():
+        for _ in uploaders:
+            upload_queue.put(None)
+        for t in uploaders:
+            t.join()
+        if upload_errors:
+            print(f"Upload batch failed: {upload_errors[0]}")
+            raise upload_errors[0]
+        # Updates are applied in WAL order, so waiting on the last one means
+        # every earlier upsert is applied before indexes are finalized/counted
+        if tail:
+            client.upsert(collection_name=collection, points=tail.pop(), wait=True)
+
+    existing_ids = (
+        _existing_point_ids(client, collection) if args.skip_existing else None
+    )
+    if existing_ids is not None:
+        print(f"  {len(existing_ids)} points already in {collection}; skipping those")
+    skipped = 0
+
     total = 0
     for rec in trial_source:
         if args.resume_from and total < args.resume_from:
@@ -333,20 +528,19 @@ def main() -> None:
         if not nct_id:
             continue
         if trials_file:
-            trials_file.write(json.dumps(rec, ensure_ascii=False) + "\n")
-        texts.append(_trial_embedding_text(rec))
+            trials_file.write(_ENCODER.encode(rec) + "\n")
         # Deterministic UUID for idempotent upserts
-        ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"ctgov-trial:{nct_id}")))
+        point_id = _trial_point_id(nct_id)
+        if existing_ids is not None and point_id in existing_ids:
+            total += 1
+            skipped += 1
+            continue
+        texts.append(_trial_embedding_text(rec))
+        ids.append(point_id)
 
         locs = rec.get("locations") or []
-        location_cities = _lower_unique(
-            [l.get("city") for l in locs if isinstance(l, dict)]
-        )
-        location_states = _lower_unique(
-            [l.get("state") for l in locs if isinstance(l, dict)]
-        )
-        location_countries = _lower_unique(
-            [l.get("country") for l in locs if isinstance(l, dict)]
+        location_cities, location_states, location_countries = _summarize_locations(
+            locs
         )
 
         incl = rec.get("inclusion_criteria") or []
@@ -385,53 +579,15 @@ def main() -> None:
 
     # close trials file if opened
     if trials_file:
-        trials_file.close()
+        _close_durably(trials_file)
 
     flush_batch()
+    finish_uploads()
+    if skipped:
+        print(f"Skipped {skipped} trials already in the collection")
 
     print("Finalizing payload indexes ...")
-    try:
-        client.create_payload_index(
-            collection,
-            field_name="overall_status",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-    except Exception:
-        pass
-    try:
-        client.create_payload_index(
-            collection,
-            field_name="gender",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-    except Exception:
-        pass
-    try:
-        client.create_payload_index(
-            collection,
-            field_name="nct_id",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-    except Exception:
-        pass
-    try:
-        client.create_payload_index(
-            collection,
-            field_name="location_cities",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="location_states",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-        client.create_payload_index(
-            collection,
-            field_name="location_countries",
-            field_schema=http_models.PayloadSchemaType.KEYWORD,
-        )
-    except Exception:
-        pass
+    _ensure_payload_indexes(client, collection)
 
     q_count = None
     try:
@@ -450,7 +606,6 @@ def main() -> None:
     # Optional snapshot after upsert
     if args.snapshot:
         from datetime import datetime
-        import tarfile, shutil
 
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         base_dir = Path("data") / "snapshots"
@@ -458,12 +613,9 @@ def main() -> None:
         snap_dir = base_dir / snap_name
         snap_dir.mkdir(parents=True, exist_ok=True)
 
-        # Copy artifacts if present
+        # Link (or copy) artifacts if present
         if trials_path.exists():
-            try:
-                shutil.copy2(str(trials_path), str(snap_dir / trials_path.name))
-            except Exception:
-                pass
+            _link_or_copy(trials_path, snap_dir / trials_path.name)
 
         manifest = {
             "snapshot": snap_name,
@@ -479,8 +631,7 @@ def main() -> None:
             mf.write(json.dumps(manifest, ensure_ascii=False, indent=2))
 
         archive_path = base_dir / f"{snap_name}.tar.gz"
-        with tarfile.open(archive_path, "w:gz") as tar:
-            tar.add(snap_dir, arcname=snap_dir.name)
+        _archive_snapshot(snap_dir, archive_path)
         print(f"Snapshot written: {snap_dir}\nArchive: {archive_path}")
 
 
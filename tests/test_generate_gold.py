@@ -0,0 +1,30 @@
+import numpy as np
+
+from eval.generate_gold import _choose_ages_and_sexes
+
+
+def test_choose_ages_keeps_zero_min_age():
+    sample = [
+        {"min_age_years": 0, "max_age_years": None, "gender": "ALL"},
+        {"min_age": 0, "max_age": 17, "gender": "FEMALE"},
+        {"min_age_years": 0, "max_age_years": 0, "gender": "MALE"},
+    ] * 50
+
+    ages, sexes = _choose_ages_and_sexes(sample, rng=np.random.default_rng(0))
+
+    # A minimum of 0 is a real bound, not a missing one (which defaults to 40)
+    assert all(0 <= age <= 10 for age in ages[0::3])
+    assert all(0 <= age <= 17 for age in ages[1::3])
+    assert min(ages[1::3]) < 7
+    assert ages[2::3] == [0] * 50
+    assert set(sexes[1::3]) == {"female"}
+    assert set(sexes[2::3]) == {"male"}
+
+
+def test_choose_ages_defaults_without_bounds():
+    ages, sexes = _choose_ages_and_sexes(
+        [{"min_age": None, "gender": "UNKNOWN"}], rng=np.random.default_rng(0)
+    )
+
+    assert ages == [40]
+    assert sexes == [None]
@@ -0,0 +1,95 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+import clinical_rag.retrieval as retrieval
+import ingest.main as ingest
+from clinical_rag.config import load_settings
+
+
+def _trial(i, title=None):
+    return {
+        "nct_id": f"NCT{i:08d}",
+        "trial_title": title or f"Trial {i}",
+        "conditions": ["asthma"],
+        "sex": "ALL",
+        "min_age_years": 18,
+        "locations": [{"city": "Boston", "state": "MA", "country": "United States"}],
+        "inclusion_criteria": ["Adults with asthma"],
+        "exclusion_criteria": ["Current smokers"],
+    }
+
+
+@pytest.fixture
+def ingest_env(monkeypatch, tmp_path):
+    """Run ingest.main against an in-memory Qdrant with a fake embedder."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("EMBEDDING_DIM_TRUNCATE", raising=False)
+    monkeypatch.setenv("COLLECTION_NAME", "trials_test")
+    load_settings.cache_clear()
+
+    client = QdrantClient(":memory:")
+    monkeypatch.setattr(ingest, "QdrantClient", lambda *a, **k: client)
+    embedded = []
+
+    def _embed_passages(texts, *, device="cpu"):
+        embedded.extend(texts)
+        return np.ones((len(texts), 384), dtype=np.float32)
+
+    monkeypatch.setattr(retrieval, "embed_passages", _embed_passages)
+
+    def run(trials, *flags):
+        path = tmp_path / "trials.jsonl"
+        path.write_text("".join(json.dumps(t) + "\n" for t in trials))
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["ingest", "--upsert-from", str(path), "--batch-size", "40", *flags],
+        )
+        ingest.main()
+
+    yield client, embedded, run
+    load_settings.cache_clear()
+
+
+def _titles(client):
+    points, _ = client.scroll("trials_test", limit=1000, with_payload=True)
+    return {p.payload["nct_id"]: p.payload["trial_title"] for p in points}
+
+
+def test_ingest_uploads_every_trial_once(ingest_env):
+    client, embedded, run = ingest_env
+
+    run([_trial(i) for i in range(100)], "--parallel", "3")
+
+    # Batches are embedded and upserted by parallel workers; nothing is lost
+    assert client.count("trials_test", exact=True).count == 100
+    assert len(embedded) == 100
+    (point,) = client.retrieve("trials_test", [ingest._trial_point_id("NCT00000007")])
+    payload = point.payload
+    assert payload["location_cities"] == ["boston"]
+    assert payload["inclusion_count"] == 1
+
+    # Point ids are derived from NCT ids, so a rerun overwrites in place
+    run([_trial(i, title="Renamed") for i in range(100)])
+    assert client.count("trials_test", exact=True).count == 100
+    assert set(_titles(client).values()) == {"Renamed"}
+
+
+
+def test_ingest_skip_existing_only_embeds_new_trials(ingest_env):
+    client, embedded, run = ingest_env
+    run([_trial(i) for i in range(5)])
+    embedded.clear()
+
+    run([_trial(i, title="Renamed") for i in range(8)], "--skip-existing")
+
+    titles = _titles(client)
+    assert len(titles) == 8
+    assert len(embedded) == 3
+    # Trials already in the collection are skipped, not refreshed
+    assert titles["NCT00000000"] == "Trial 0"
+    assert titles["NCT00000007"] == "Renamed"
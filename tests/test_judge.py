@@ -0,0 +1,173 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import clinical_rag.judge as judge
+
+
+def _chunk(content):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class _Stream:
+    """Sync completion stream that yields `pieces` and records how far it was read."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.read = []
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.pieces:
+            self.read.append(piece)
+            yield _chunk(piece)
+
+    def close(self):
+        self.closed = True
+
+
+class _StreamingLLM:
+    """Chat client stand-in returning one `_Stream` of `pieces` per call."""
+
+    def __init__(self, pieces):
+        self.calls = []
+        self.streams = []
+
+        def _create(*, model, messages, temperature, **kwargs):
+            self.calls.append((messages, kwargs))
+            stream = _Stream(pieces)
+            self.streams.append(stream)
+            return stream
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=_create))
+
+
+class _AsyncStream(_Stream):
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class _AsyncLLM:
+    """Async chat client stand-in answering with a per-trial verdict."""
+
+    def __init__(self):
+        self.calls = 0
+
+        async def _create(*, model, messages, temperature, **kwargs):
+            self.calls += 1
+            nct = messages[-1]["content"].split("TRIAL: ")[1].split("\n")[0]
+            verdict = {"nct_id": nct, "eligibility": "INELIGIBLE"}
+            return _AsyncStream([json.dumps({"verdicts": [verdict]})])
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=_create))
+
+
+def _grouped(*nct_ids):
+    return {
+        nct: {
+            "info": {"trial_title": f"Trial {nct}", "conditions": ["asthma"]},
+            "incl_ids": (f"{nct}-i0",),
+            "incl_texts": ("Adults with asthma",),
+            "excl_ids": (f"{nct}-e0",),
+            "excl_texts": ("Current smokers",),
+        }
+        for nct in nct_ids
+    }
+
+
+def test_parse_verdicts_reads_json_mode_object():
+    content = json.dumps(
+        {
+            "verdicts": [
+                {"nct_id": "NCT1", "eligibility": " ineligible ", "explanation": "x"},
+                {"nct_id": "NCT2", "eligibility": "maybe", "explanation": 3},
+            ]
+        }
+    )
+
+    verdicts = judge.parse_verdicts(content)
+
+    assert [v["eligibility"] for v in verdicts] == ["INELIGIBLE", "POSSIBLY ELIGIBLE"]
+    assert verdicts[1]["explanation"] == "3"
+
+
+def test_parse_verdicts_falls_back_to_fenced_array():
+    content = (
+        "Here you go:\n```json\n"
+        '[{"nct_id": "NCT1", "eligibility": "INELIGIBLE"}]\n```'
+    )
+
+    verdicts = judge.parse_verdicts(content)
+
+    assert verdicts == [
+        {"nct_id": "NCT1", "eligibility": "INELIGIBLE", "explanation": ""}
+    ]
+    assert judge.parse_verdicts("not json at all") == []
+
+
+def test_judge_grouped_requests_json_mode(monkeypatch):
+    answer = json.dumps(
+        {"verdicts": [{"nct_id": "NCT1", "eligibility": "INELIGIBLE"}]}
+    )
+    client = _StreamingLLM([answer])
+    monkeypatch.setattr(judge, "get_client", lambda: client)
+
+    verdicts = judge.judge_grouped({"conditions": ["asthma"]}, _grouped("NCT1"))
+
+    ((messages, kwargs),) = client.calls
+    assert kwargs["response_format"] == {"type": "json_object"}
+    assert messages[0]["role"] == "system"
+    assert '{"verdicts": [...]}' in messages[0]["content"]
+    assert verdicts[0]["nct_id"] == "NCT1"
+    assert verdicts[0]["eligibility"] == "INELIGIBLE"
+
+
+def test_judge_stream_stops_at_closing_brace(monkeypatch):
+    pieces = [
+        '{"verdicts": [{"nct_id": "NCT1", "eligibility": "INEL',
+        'IGIBLE", "explanation": "uses {braces}"}]}',
+        "TRAILING",
+    ]
+    client = _StreamingLLM(pieces)
+    monkeypatch.setattr(judge, "get_client", lambda: client)
+
+    verdicts = judge.judge_grouped({"conditions": ["asthma"]}, _grouped("NCT1"))
+
+    ((_, kwargs),) = client.calls
+    (stream,) = client.streams
+    assert kwargs["stream"] is True
+    # Reading ends once the top-level object closes; the stream is released
+    assert "TRAILING" not in stream.read
+    assert stream.closed
+    assert verdicts[0]["explanation"] == "uses {braces}"
+
+
+def test_judge_one_async_memoizes_verdicts():
+    judge.clear_verdict_cache()
+    client = _AsyncLLM()
+    grouped = _grouped("NCT1", "NCT2")
+    spec = {"age": 40, "conditions": ["asthma"], "location": "Boston"}
+
+    async def _run(spec):
+        return [
+            await judge.judge_one_async(spec, nct, ctx, model="m", client=client)
+            for nct, ctx in grouped.items()
+        ]
+
+    first = asyncio.run(_run(spec))
+    # Only eligibility-relevant fields key the cache; location does not
+    again = asyncio.run(_run({**spec, "location": "Chicago"}))
+    assert client.calls == 2
+    assert again == first
+    assert again[0] is not first[0]  # callers get copies
+
+    asyncio.run(_run({**spec, "age": 41}))
+    assert client.calls == 4
+    stats = judge.get_stats()
+    assert (stats["hits"], stats["misses"]) == (2, 4)
+    judge.clear_verdict_cache()
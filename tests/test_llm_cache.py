@@ -0,0 +1,24 @@
+from eval.llm_cache import LLMCache, cache_key
+
+
+def test_llm_cache_persists_across_reopen(tmp_path):
+    path = tmp_path / "nested" / "cache.sqlite"
+    key = cache_key("gold", "gpt-4o-mini", "system", "user")
+
+    with LLMCache(path) as cache:
+        assert cache.get(key) is None
+        cache.put(key, "first")
+        cache.put(key, "second")  # a re-answered prompt replaces the old value
+
+    with LLMCache(path) as cache:
+        assert cache.get(key) == "second"
+
+
+def test_cache_key_separates_namespace_model_and_parts():
+    base = cache_key("gold", "m", "ab", "c")
+
+    assert base == cache_key("gold", "m", "ab", "c")
+    assert base != cache_key("parse", "m", "ab", "c")
+    assert base != cache_key("gold", "m2", "ab", "c")
+    # Parts are delimited, so shifting text between them changes the key
+    assert base != cache_key("gold", "m", "a", "bc")
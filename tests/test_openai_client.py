@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import clinical_rag._openai as oa
+
+
+@pytest.fixture(autouse=True)
+def _fresh_client(monkeypatch):
+    monkeypatch.setattr(oa, "_client", None)
+
+
+def test_get_client_is_shared(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    clients = []
+
+    def _get():
+        clients.append(oa.get_client())
+
+    threads = [threading.Thread(target=_get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Racing first calls still build one client (and one connection pool)
+    assert len({id(c) for c in clients}) == 1
+    assert oa.get_client() is clients[0]
+
+
+def test_get_client_requires_key_until_set(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+    with pytest.raises(RuntimeError, match="OPENAI_API_KEY"):
+        oa.get_client()
+
+    # A failed first call leaves nothing cached, so a key set later still works
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    assert oa.get_client() is not None
+
+
+def test_rate_limiter_spaces_requests_past_burst():
+    limiter = oa.AsyncRateLimiter(2, period=0.2)  # 2 per 0.2s: refills every 0.1s
+
+    async def _run():
+        stamps = []
+        for _ in range(4):
+            await limiter.acquire()
+            stamps.append(time.monotonic())
+        # Larger than the bucket: capped, so it waits for a full bucket, not forever
+        await limiter.acquire(amount=10)
+        stamps.append(time.monotonic())
+        return stamps
+
+    start = time.monotonic()
+    stamps = [t - start for t in asyncio.run(_run())]
+
+    assert stamps[1] < 0.05  # the first two fit in the initial burst
+    assert stamps[3] >= 0.18
+    assert stamps[4] - stamps[3] >= 0.18
@@ -1,16 +1,47 @@
 import json
-import os
+from types import SimpleNamespace
 
 import pytest
 
+import clinical_rag.query_parser as qp
 
-def test_parse_llm_mock_basic(monkeypatch):
-    # Import inside test to ensure monkeypatch targets the loaded module
-    import clinical_rag.query_parser as qp
 
-    # Ensure the code path uses LLM branch
-    monkeypatch.setenv("OPENAI_API_KEY", "test")
+def _response(content: str) -> SimpleNamespace:
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
 
+
+def _chat(create) -> SimpleNamespace:
+    return SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+class _FakeLLM:
+    """Chat client stand-in that answers every call with `content`.
+
+    Each call's messages and extra kwargs are recorded in `calls`.
+    """
+
+    def __init__(self, content: str):
+        self.calls = []
+
+        def _create(*, model, messages, temperature, **kwargs):
+            self.calls.append((messages, kwargs))
+            return _response(content)
+
+        self.chat = _chat(_create)
+
+
+class _NoLLM:
+    """Client stand-in for paths that must answer without calling the LLM."""
+
+    def __init__(self, reason: str):
+        def _fail(*args, **kwargs):
+            raise AssertionError(reason)
+
+        self.chat = _chat(_fail)
+
+
+def test_parse_llm_mock_basic():
     expected = {
         "age": None,
         "sex": None,
@@ -20,45 +51,144 @@ def test_parse_llm_mock_basic(monkeypatch):
         "location": None,
     }
 
-    class _Msg:
-        def __init__(self, content: str):
-            self.content = content
+    # An injected client bypasses the parse cache, so no reset is needed
+    client = _FakeLLM(json.dumps(expected))
 
-    class _Choice:
-        def __init__(self, content: str):
-            self.message = _Msg(content)
+    text = (
+        "42-year-old female with metastatic breast cancer; currently taking letrozole "
+        "and palbociclib; prefers oral therapy and minimal clinic visits; in New York City."
+    )
+    spec = qp.parse(text, client=client)
 
-    class _Resp:
-        def __init__(self, content: str):
-            self.choices = [_Choice(content)]
+    assert len(client.calls) == 1
+    assert spec == expected
 
-    class _Completions:
-        def create(self, model, messages, temperature):
-            return _Resp(json.dumps(expected))
 
-    class _Chat:
-        def __init__(self):
-            self.completions = _Completions()
+def test_parse_reuses_cached_llm_output(monkeypatch):
+    client = _FakeLLM(json.dumps({"conditions": ["asthma"]}))
+    # Only the shared client is cached; start from a clean cache
+    monkeypatch.setattr(qp, "get_client", lambda: client)
+    qp._parse_cached.cache_clear()
 
-    class _OpenAI:
-        def __init__(self):
-            self.chat = _Chat()
+    first = qp.parse("30 y/o with asthma")
+    # Whitespace differences normalize to the same cache entry
+    second = qp.parse("  30 y/o   with\nasthma ")
 
-    # Patch the OpenAI client used in the module
-    monkeypatch.setattr(qp, "OpenAI", _OpenAI)
+    assert len(client.calls) == 1
+    assert first == second
+    assert first is not second  # callers get independent dicts
 
-    text = (
-        "42-year-old female with metastatic breast cancer; currently taking letrozole "
-        "and palbociclib; prefers oral therapy and minimal clinic visits; in New York City."
+
+def test_parse_streaming_stops_at_closing_brace(monkeypatch):
+    monkeypatch.setattr(qp, "_stream_enabled", lambda: True)
+    pieces = ['{"conditions": ["as', 'thma {x}"], "medi', 'cations": []}', "TRAILING"]
+    read = []
+
+    class _Stream:
+        closed = False
+
+        def __iter__(self):
+            for piece in pieces:
+                read.append(piece)
+                delta = SimpleNamespace(content=piece)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+        def close(self):
+            _Stream.closed = True
+
+    def _create(*, model, messages, temperature, stream=False, **kwargs):
+        assert stream
+        return _Stream()
+
+    client = SimpleNamespace(chat=_chat(_create))
+
+    spec = qp.parse("asthma", client=client)
+
+    assert spec["conditions"] == ["asthma {x}"]
+    assert "TRAILING" not in read
+    assert _Stream.closed
+
+
+def test_parse_keeps_system_prefix_stable():
+    client = _FakeLLM("{}")
+
+    qp.parse("history of gout", client=client)
+    qp.parse("x" * 5000, client=client)
+
+    (first, kwargs1), (second, kwargs2) = client.calls
+    # A byte-identical system prefix is what lets the server-side prompt cache hit
+    assert first[0]["role"] == "system"
+    assert first[0]["content"] == second[0]["content"]
+    assert kwargs1["prompt_cache_key"] == kwargs2["prompt_cache_key"]
+    assert len(second[1]["content"]) == qp._MAX_INPUT_CHARS
+
+
+def test_parse_template_intake_skips_llm():
+    client = _NoLLM("template intakes must not call the LLM")
+
+    spec = qp.parse(
+        "55-year-old male with type 2 diabetes, hypertension; "
+        "currently taking metformin; prefers telemedicine; in Austin, Texas.",
+        client=client,
     )
-    spec = qp.parse(text)
 
-    assert spec == expected
+    assert spec["conditions"] == ["type 2 diabetes", "hypertension"]
+    assert spec["medications"] == ["metformin"]
+    assert spec["extra_terms"] == ["telemedicine"]
+    assert spec["location"] is None
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "60-year-old male with head and neck cancer",
+        "8-year-old male with hand, foot and mouth disease",
+        "50-year-old male with copd; history of smoking",
+        "45-year-old female with no history of cancer",
+        "45-year-old female with asthma; taking no medications",
+        "45-year-old female with asthma; on a waitlist",
+        "50 year old male with denies chest pain",
+    ],
+)
+def test_parse_ambiguous_template_items_use_llm(text):
+    client = _FakeLLM(json.dumps({"conditions": []}))
+
+    qp.parse(text, client=client)
+
+    # Compound, historical, negated or non-clinical items must not be split or
+    # taken literally as retrieval terms
+    assert qp._template_parse(text) is None
+    assert len(client.calls) == 1
+
+
+def test_parse_pre_structured_skips_llm():
+    client = _NoLLM("blank or pre-structured input must not call the LLM")
+    expected = {
+        "age": None,
+        "sex": None,
+        "conditions": ["gout"],
+        "medications": ["allopurinol"],
+        "extra_terms": [],
+        "location": None,
+    }
 
+    assert qp.parse(json.dumps(expected), client=client) == expected
+    assert qp.parse("   ", client=client)["conditions"] == []
 
-def test_build_query_text_deterministic():
-    from clinical_rag.query_parser import build_query_text
+    # Demographics a pipeline re-feeds are kept, even past the LLM input cap
+    refed = {
+        **expected,
+        "age": 40,
+        "sex": "female",
+        "location": "Boston",
+        "extra_terms": ["term"] * qp._MAX_INPUT_CHARS,
+    }
+    spec = qp.parse(json.dumps(refed), client=client)
+    assert (spec["age"], spec["sex"], spec["location"]) == (40, "female", "Boston")
+    assert len(spec["extra_terms"]) == qp._MAX_INPUT_CHARS
 
+
+def test_build_query_text_deterministic():
     spec = {
         "age": None,
         "sex": None,
@@ -68,7 +198,7 @@ def test_build_query_text_deterministic():
         "location": None,
     }
 
-    q = build_query_text(spec)
+    q = qp.build_query_text(spec)
     assert "sex:" not in q
     assert "conditions:metastatic breast cancer" in q
     assert "meds:letrozole, palbociclib" in q
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as http_models
+
+import clinical_rag.retrieval as retrieval
+from clinical_rag.config import load_settings
+
+
+@pytest.fixture
+def fake_embed(monkeypatch):
+    """Deterministic 8-dim embeddings instead of the ONNX model."""
+    calls = []
+
+    def _embed(texts, *, device="cpu"):
+        calls.append(list(texts))
+        return np.stack(
+            [np.arange(1, 9, dtype=np.float32) * (len(t) or 1) for t in texts]
+        )
+
+    monkeypatch.setattr(retrieval, "_embed", _embed)
+    retrieval._weighted_query_vector_cached.cache_clear()
+    yield calls
+    retrieval._weighted_query_vector_cached.cache_clear()
+    load_settings.cache_clear()
+
+
+def test_query_vector_cache_tracks_truncation(monkeypatch, fake_embed):
+    spec = {"conditions": ["asthma"], "medications": ["albuterol"]}
+
+    monkeypatch.delenv("EMBEDDING_DIM_TRUNCATE", raising=False)
+    load_settings.cache_clear()
+    full = retrieval._weighted_query_vector(spec)
+
+    monkeypatch.setenv("EMBEDDING_DIM_TRUNCATE", "4")
+    load_settings.cache_clear()
+    truncated = retrieval._weighted_query_vector(spec)
+
+    # A changed setting must not be served the cached full-size vector
+    assert full.shape == (8,)
+    assert truncated.shape == (4,)
+    assert np.isclose(np.linalg.norm(truncated), 1.0)
+    assert len(fake_embed) == 2
+
+    # Same spec and setting: the cached vector is reused, read-only
+    assert retrieval._weighted_query_vector(spec) is truncated
+    assert not truncated.flags.writeable
+    assert len(fake_embed) == 2
+
+
+def test_build_filters_normalizes_and_memoizes():
+    spec = {
+        "sex": "female",
+        "age": 40,
+        "location": {"city": " Boston ", "state": "MA", "country": None},
+    }
+
+    qfilter = retrieval.build_filters(spec)
+
+    gender, min_age, max_age, city, state = qfilter.must
+    assert gender.key == "gender" and gender.match.any == ["FEMALE", "ALL"]
+    assert min_age.key == "min_age" and min_age.range.lte == 40
+    assert (city.key, city.match.value) == ("location_cities", "boston")
+    assert (state.key, state.match.value) == ("location_states", "ma")
+    # Specs that normalize to the same fields share one Filter object
+    same = {**spec, "sex": "FEMALE", "location": {"city": "boston", "state": "ma"}}
+    assert retrieval.build_filters(same) is qfilter
+
+
+def test_build_filters_skips_unusable_fields():
+    assert retrieval.build_filters({}) is None
+    unusable = {"sex": "unknown", "age": "40", "location": "x"}
+    assert retrieval.build_filters(unusable) is None
+
+
+def test_age_filter_keeps_open_ended_trials_server_side():
+    client = QdrantClient(":memory:")
+    client.create_collection(
+        "trials",
+        vectors_config=http_models.VectorParams(
+            size=2, distance=http_models.Distance.COSINE
+        ),
+    )
+    payloads = {
+        1: {"min_age": 18, "max_age": 30},
+        2: {"min_age": 18, "max_age": 65},
+        3: {"min_age": 18},  # no upper bound
+        4: {"min_age": 50, "max_age": 80},
+    }
+    client.upsert(
+        "trials",
+        points=[
+            http_models.PointStruct(id=pid, vector=[1.0, 0.0], payload=payload)
+            for pid, payload in payloads.items()
+        ],
+    )
+
+    hits = client.query_points(
+        "trials",
+        query=[1.0, 0.0],
+        query_filter=retrieval.build_filters({"age": 40}),
+        limit=10,
+    ).points
+
+    # max_age is enforced in Qdrant; a missing max_age means no upper bound
+    assert sorted(h.id for h in hits) == [2, 3]